@@ -0,0 +1,82 @@
+import random
+import sys
+import time
+import tracemalloc
+
+import jama.change as cmod
+from jama.history import CountingHistory
+
+
+def edit(file_, rnd, edits):
+    for _ in range(edits):
+        pos = rnd.randrange(len(file_) + 1)
+        if rnd.random() < 0.5:
+            file_ = file_.insert(pos, rnd.randrange(1, 5))
+        else:
+            file_ = file_.delete(pos, rnd.randrange(1, 5))
+    return file_
+
+
+def sides(size, edits, rnd):
+    base = cmod.FileReprEdit.from_size(size)
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2)
+    changes = list(cmod.Change.from_diff(base, edit(a, rnd, edits)))
+    changes.extend(cmod.Change.from_diff(base, edit(b, rnd, edits)))
+    return base, changes
+
+
+def full(base, changes):
+    state = cmod.State.from_file(base)
+    for change in changes:
+        state = change.apply(state)
+    return state
+
+
+def counting(base, changes):
+    state = cmod.State.from_file(base, history=CountingHistory())
+    for change in changes:
+        state = change.apply(state)
+    return state
+
+
+def transaction(base, changes):
+    state = cmod.State.from_file(base, history=CountingHistory())
+    transaction = state.transaction()
+    for change in changes:
+        transaction.apply(change)
+    return transaction.finish()
+
+
+modes = (("full", full), ("counting", counting), ("transaction", transaction))
+default_sizes = (10000, 100000)
+
+
+def main(sizes=default_sizes, edits=1000):
+    print(
+        "{:>8} {:>12} {:>12} {:>12} {:>8}".format(
+            "lines", "mode", "retained", "peak", "seconds"
+        )
+    )
+    for size in sizes:
+        base, changes = sides(size, edits, random.Random(0))
+        expected = None
+        for name, merge in modes:
+            tracemalloc.start()
+            start = time.perf_counter()
+            state = merge(base, changes)
+            seconds = time.perf_counter() - start
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            linear = state.linearize()
+            expected = expected or linear
+            assert linear == expected
+            print(
+                "{:>8} {:>12} {:>12} {:>12} {:>8.2f}".format(
+                    size, name, retained, peak, seconds
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(tuple(int(x) for x in sys.argv[1:]) or default_sizes)
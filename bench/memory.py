@@ -0,0 +1,56 @@
+import random
+import sys
+import tracemalloc
+
+import jama.change as cmod
+from jama.memory import memory_report
+
+
+def edit(file_, rnd):
+    pos = rnd.randrange(len(file_) + 1)
+    if rnd.random() < 0.5:
+        return file_.insert(pos, rnd.randrange(1, 5))
+    return file_.delete(pos, rnd.randrange(1, 5))
+
+
+def build(size, commits, rnd):
+    cur = cmod.FileReprEdit.from_size(size)
+    state = cmod.State.from_file(cur)
+    for _ in range(commits):
+        prev, cur = cur, edit(cur, rnd)
+        for change in cmod.Change.from_diff(prev, cur):
+            state = change.apply(state)
+    return state
+
+
+default_sizes = (1000, 10000, 50000)
+
+
+def main(sizes=default_sizes, commits=50):
+    rnd = random.Random(0)
+    print(
+        "{:>8} {:>12} {:>12} {:>10} {:>10} {:>10} {:>8}".format(
+            "lines", "traced", "reported", "nodes", "edges", "history", "b/line"
+        )
+    )
+    for size in sizes:
+        tracemalloc.start()
+        state = build(size, commits, rnd)
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report = memory_report(state)
+        print(
+            "{:>8} {:>12} {:>12} {:>10} {:>10} {:>10} {:>8.1f}".format(
+                size,
+                traced,
+                report.total,
+                report.nodes,
+                report.edges,
+                report.history,
+                report.bytes_per_line,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(tuple(int(x) for x in sys.argv[1:]) or default_sizes)
@@ -0,0 +1,54 @@
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import jama.change as cmod
+from jama.parallel import linearize_files
+
+
+def edit(file_, rnd):
+    pos = rnd.randrange(len(file_) + 1)
+    if rnd.random() < 0.6:
+        return file_.insert(pos, rnd.randrange(1, 5))
+    return file_.delete(pos, rnd.randrange(1, 5))
+
+
+def build(size, commits, rnd):
+    base = cmod.FileReprEdit.from_size(size)
+    state = cmod.State.from_file(base)
+    for replica in (1, 2):
+        cur = cmod.ReplicaFileReprEdit(base.node_list, state.max_node, replica)
+        for _ in range(commits):
+            cur = edit(cur, rnd)
+        for change in cmod.Change.from_diff(base, cur):
+            state = change.apply(state)
+    return state
+
+
+def timed(func):
+    begin = time.perf_counter()
+    func()
+    return time.perf_counter() - begin
+
+
+def main(files=64, size=5000, big=50000, commits=20):
+    rnd = random.Random(0)
+    tree = [build(rnd.randrange(size // 10, size), commits, rnd) for _ in range(files)]
+    large = [build(big, commits, rnd)]
+    print("{:>8} {:>10} {:>10}".format("workers", "tree", "large"))
+    serial_tree = timed(lambda: [x.linearize() for x in tree])
+    serial_large = timed(lambda: [x.linearize() for x in large])
+    print("{:>8} {:>10.3f} {:>10.3f}".format("serial", serial_tree, serial_large))
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ProcessPoolExecutor(workers) as executor:
+            tree_time = timed(lambda: linearize_files(executor, tree))
+            large_time = timed(lambda: linearize_files(executor, large, split=size))
+        print("{:>8} {:>10.3f} {:>10.3f}".format(workers, tree_time, large_time))
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
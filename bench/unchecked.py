@@ -0,0 +1,50 @@
+import sys
+import time
+
+import jama.change as cmod
+from jama import codec
+
+cn = cmod.FileNodes.content
+
+
+def best(func, *args, repeat=5):
+    result = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        result = min(result, time.perf_counter() - start)
+    return result
+
+
+def construct(cls, args, count):
+    for _ in range(count):
+        cls(*args)
+
+
+def construct_unchecked(cls, args, count):
+    unchecked = cls.unchecked
+    for _ in range(count):
+        unchecked(*args)
+
+
+def main(count=100000):
+    print("{:>8} {:>10} {:>10}".format("change", "checked", "unchecked"))
+    cases = (
+        ("Insert", cmod.Insert, (cn, [cn + 5], cn + 1)),
+        ("Delete", cmod.Delete, (cn + 3,)),
+        ("Move", cmod.Move, (cn, [cn + 5, cn + 6], cn + 1)),
+    )
+    for name, cls, args in cases:
+        checked = best(construct, cls, args, count)
+        unchecked = best(construct_unchecked, cls, args, count)
+        print("{:>8} {:>10.3f} {:>10.3f}".format(name, checked, unchecked))
+    changes = [cmod.Insert(cn + x, [cn + x + 1], cn + x + 2) for x in range(count)]
+    changes += [cmod.Delete(cn + x) for x in range(count)]
+    data = codec.encode_changes(changes)
+    checked = best(lambda: list(codec.decode_changes(data)))
+    unchecked = best(lambda: list(codec.decode_changes(data, check=False)))
+    print("{:>8} {:>10.3f} {:>10.3f}".format("decode", checked, unchecked))
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
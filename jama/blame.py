@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Any, Iterable, Optional
+
+from attr import dataclass
+
+from .change import Change, State
+
+
+@dataclass(slots=True, frozen=True)
+class BlameLine(object):
+    uid: int
+    # Index of the Insert in history, None for lines of the initial file
+    index: Optional[int]
+    change: Optional[Change]
+    commit: Any
+
+
+def blame(
+    state: State, commits: Iterable[tuple[int, Any]] = (), base: Any = None
+) -> Iterable[BlameLine]:
+    # Yields a BlameLine for every line of state.to_file(). commits are (index of the
+    # first change of the commit in history, commit) sorted by index, lines created
+    # before the first commit or without a change are attributed to base. Uses the
+    # creators index of state, so the cost is independent of the length of history.
+    starts = []
+    ids = []
+    for start, commit in commits:
+        starts.append(start)
+        ids.append(commit)
+    creators = state.creators
+    history = state.history
+    for uid in state.to_file().node_list:
+        index = creators.get(uid)
+        if index is None:
+            yield BlameLine(uid, None, None, base)
+            continue
+        at = bisect_right(starts, index) - 1
+        commit = ids[at] if at >= 0 else base
+        yield BlameLine(uid, index, history[index], commit)
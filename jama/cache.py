@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+
+from .change import Change, FileRepr
+from .codec import DecodeError, decode_changes, encode_changes
+
+# Memoizes Change.from_diff by the fingerprints of both files. Entries are evicted in
+# LRU order, with a directory they are also stored on disk in the codec format and
+# survive the process. Files on disk are evicted in LRU order too, by modification
+# time, which is bumped on every hit, when they exceed disk_size bytes.
+
+_key_size = 64
+
+
+class DiffCache(object):
+    __slots__ = (
+        "size",
+        "directory",
+        "disk_size",
+        "hits",
+        "misses",
+        "_entries",
+        "_files",
+        "_disk_used",
+    )
+
+    def __init__(
+        self,
+        size: int = 1024,
+        directory: Optional[str] = None,
+        disk_size: int = 64 << 20,
+    ):
+        self.size = size
+        self.directory = directory
+        self.disk_size = disk_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, tuple[Change, ...]] = OrderedDict()
+        # File name -> size in LRU order
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self._disk_used = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _scan(self):
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Skips temporary files of other writers
+                if len(entry.name) == _key_size and entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+        files.sort()
+        for _, name, size in files:
+            self._files[name] = size
+            self._disk_used += size
+        self._evict()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(str(self.directory), name)
+
+    def _load(self, key: bytes) -> Optional[tuple[Change, ...]]:
+        name = key.hex()
+        try:
+            with open(self._path(name), "rb") as f:
+                changes = tuple(decode_changes(f.read()))
+            os.utime(self._path(name))
+        except (OSError, DecodeError):
+            return None
+        if name in self._files:
+            self._files.move_to_end(name)
+        return changes
+
+    def _store(self, key: bytes, changes: tuple[Change, ...]):
+        data = encode_changes(changes)
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            name = key.hex()
+            os.replace(tmp, self._path(name))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._disk_used += len(data) - self._files.pop(name, 0)
+        self._files[name] = len(data)
+        self._evict()
+
+    def _evict(self):
+        files = self._files
+        while self._disk_used > self.disk_size and files:
+            name, size = files.popitem(last=False)
+            self._disk_used -= size
+            try:
+                os.unlink(self._path(name))
+            except OSError:
+                pass
+
+    def _insert(self, key: bytes, changes: tuple[Change, ...]):
+        entries = self._entries
+        entries[key] = changes
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def diff(self, a: FileRepr, b: FileRepr) -> list[Change]:
+        key = a.fingerprint() + b.fingerprint()
+        entries = self._entries
+        changes = entries.get(key)
+        if changes is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return list(changes)
+        if self.directory is not None:
+            changes = self._load(key)
+        if changes is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            changes = tuple(Change.from_diff(a, b))
+            if self.directory is not None:
+                self._store(key, changes)
+        self._insert(key, changes)
+        return list(changes)
+
+    def clear(self):
+        self._entries.clear()
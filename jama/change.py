@@ -1,22 +1,176 @@
 from __future__ import annotations
 
+import itertools
+from array import array
+from bisect import bisect_left
+from collections import deque
 from difflib import SequenceMatcher
 from enum import IntEnum
-from typing import Any, Generator, Iterable, Union, cast
+from hashlib import blake2b
+from typing import Any, Generator, Iterable, Optional, Sequence, Union, cast
 
 import attr
 from attr import dataclass
-from pyrsistent import ny, pset, pvector
-from pyrsistent.typing import PSet, PVector
+from pyrsistent import PVector as PVectorType, ny, pmap, pset, pvector
+from pyrsistent.typing import PMap, PSet, PVector
 from retworkx import PyDAG  # type: ignore
 
+from .core import InconsistentError, gaps as core_gaps, order
+from .piece import PieceTable
+from .position import PositionIndex
+from .treap import mix as _mix
+
 Edge = tuple[int, int]
 
 
+class ConflictError(Exception):
+    pass
+
+
 def get_diff(a, b):
     return SequenceMatcher(a=a, b=b, autojunk=False).get_opcodes()
 
 
+# Streaming diff: both iterables are read in lockstep and synchronized on anchors, an
+# item read from one side that is pending on the other side. The gaps between anchors
+# are diffed independently, so memory is bounded by the largest gap, not by the input.
+# Anchors are exact for uids, for lines with duplicates (blank lines) the diff is valid
+# but might not be minimal.
+_end: Any = object()
+
+
+class _Gap(object):
+    __slots__ = ("items", "base", "index")
+
+    def __init__(self):
+        self.items: deque = deque()
+        # Absolute position of the first pending item
+        self.base = 0
+        self.index: dict = {}
+
+    def add(self, item):
+        self.index.setdefault(item, self.base + len(self.items))
+        self.items.append(item)
+
+    def take(self, end: int) -> list:
+        # Removes the items before the absolute position end
+        items = []
+        index = self.index
+        while self.base < end:
+            item = self.items.popleft()
+            if index.get(item) == self.base:
+                del index[item]
+            items.append(item)
+            self.base += 1
+        return items
+
+    def rest(self) -> list:
+        return self.take(self.base + len(self.items))
+
+
+def _cut(gap_a: _Gap, gap_b: _Gap, anchor):
+    a_at = gap_a.index[anchor]
+    b_at = gap_b.index[anchor]
+    a_start = gap_a.base
+    b_start = gap_b.base
+    a_items = gap_a.take(a_at)
+    b_items = gap_b.take(b_at)
+    gap_a.take(a_at + 1)
+    gap_b.take(b_at + 1)
+    return a_start, a_items, b_start, b_items, anchor
+
+
+def _anchored(a: Iterable, b: Iterable):
+    # Yields the gaps before each anchor and the gaps after the last anchor with _end
+    a = iter(a)
+    b = iter(b)
+    gap_a = _Gap()
+    gap_b = _Gap()
+    while True:
+        x = next(a, _end)
+        y = next(b, _end)
+        if x is _end and y is _end:
+            break
+        if x is not _end:
+            gap_a.add(x)
+        if y is not _end:
+            gap_b.add(y)
+        if x is not _end and x in gap_b.index:
+            yield _cut(gap_a, gap_b, x)
+        elif y is not _end and y in gap_a.index:
+            yield _cut(gap_a, gap_b, y)
+    yield gap_a.base, gap_a.rest(), gap_b.base, gap_b.rest(), _end
+
+
+def _join_equal(opcodes):
+    pending = None
+    for opcode in opcodes:
+        if pending is None:
+            pending = opcode
+        elif opcode[0] == pending[0] == "equal" and opcode[1] == pending[2]:
+            pending = ("equal", pending[1], opcode[2], pending[3], opcode[4])
+        else:
+            yield pending
+            pending = opcode
+    if pending is not None:
+        yield pending
+
+
+def _stream_opcodes(a: Iterable, b: Iterable):
+    for a_start, a_items, b_start, b_items, anchor in _anchored(a, b):
+        opcodes = get_diff(a_items, b_items) if a_items or b_items else ()
+        for tag, a_left, a_right, b_left, b_right in opcodes:
+            yield (
+                tag,
+                a_start + a_left,
+                a_start + a_right,
+                b_start + b_left,
+                b_start + b_right,
+            )
+        if anchor is not _end:
+            a_at = a_start + len(a_items)
+            b_at = b_start + len(b_items)
+            yield "equal", a_at, a_at + 1, b_at, b_at + 1
+
+
+def stream_opcodes(a: Iterable, b: Iterable):
+    # Opcodes like get_diff, yielded while a and b are read
+    return _join_equal(_stream_opcodes(a, b))
+
+
+# Fingerprints are sums of mixed 64bit hashes, so they are independent of the order the
+# edges and nodes were added in and can be updated incrementally. Python's hash() is not
+# used, because fingerprints have to be stable across processes.
+_mask = (1 << 64) - 1
+
+
+def node_fingerprint(node: int) -> int:
+    return _mix((node << 1) & _mask)
+
+
+def edge_fingerprint(edge: Edge) -> int:
+    return _mix(_mix(edge[0] & _mask) ^ (((edge[1] << 1) | 1) & _mask))
+
+
+def graph_fingerprint(nodes: Iterable[bool], edges: Iterable[Edge]) -> int:
+    fingerprint = 0
+    for node, visible in enumerate(nodes):
+        if visible:
+            fingerprint += node_fingerprint(node)
+    for edge in edges:
+        fingerprint += edge_fingerprint(edge)
+    return fingerprint & _mask
+
+
+_delete_salt = 0x5DE1E7E5
+_revert_salt = 0x7E7E7E7E
+_move_salt = 0x30F30F30
+
+
+def chain_fingerprint(fingerprint: int, change: Change) -> int:
+    return _mix(fingerprint ^ change.fingerprint())
+
+
 class FileNodes(IntEnum):
     start = -2
     end = -1
@@ -28,11 +182,55 @@ class _IntFileNodes(IntEnum):
     end = 1
 
 
+# Uids of concurrent writers pack (counter, replica) into one int. The counter is in the
+# high bits, so uids are ordered by counter first and the replica breaks ties. The width
+# of the replica field is chosen per document and all its replicas have to use the same.
+# Since State.nodes is dense, every replica bit doubles the worst case size of
+# State.nodes, so the default is small.
+REPLICA_BITS = 4
+MAX_REPLICAS = 1 << REPLICA_BITS
+
+
+def pack_uid(counter: int, replica: int, bits: int = REPLICA_BITS) -> int:
+    assert 0 <= replica < 1 << bits
+    return ((counter << bits) | replica) + FileNodes.content
+
+
+def unpack_uid(uid: int, bits: int = REPLICA_BITS) -> tuple[int, int]:
+    uid -= FileNodes.content
+    return uid >> bits, uid & ((1 << bits) - 1)
+
+
+def _replica_uids(max_uid: int, size: int, replica: int, bits: int) -> list[int]:
+    # The uids of an insert of size lines by replica, after all uids up to max_uid
+    counter = unpack_uid(max_uid, bits)[0] + 1
+    return [pack_uid(counter + x, replica, bits) for x in range(size)]
+
+
+def _pset(items: Iterable) -> PSet:
+    # pset() sizes its hash table for 8 items, whatever it is passed. Lookups are linear
+    # until the first add reallocates it.
+    items = list(items)
+    return pset(items, pre_size=2 * len(items))
+
+
+def _as_pvector(node_list: Iterable[int]) -> PVector[int]:
+    # Vectors are immutable, sharing them avoids a copy per FileRepr
+    if isinstance(node_list, PVectorType):
+        return node_list
+    return pvector(node_list)
+
+
 @dataclass(slots=True, frozen=True)
 class FileRepr(object):
     node_list: PVector[int]
+    digest: Optional[bytes]
 
-    node_list = cast(PVector[int], attr.ib(converter=pvector))
+    node_list = cast(PVector[int], attr.ib(converter=_as_pvector))
+    # Cached by fingerprint(), FileReprs are immutable
+    digest = cast(
+        Optional[bytes], attr.ib(default=None, init=False, eq=False, repr=False)
+    )
 
     @classmethod
     def from_user(cls, node_list):
@@ -41,6 +239,13 @@ class FileRepr(object):
     def to_user(self):
         return self.node_list.transform([ny], lambda x: x - FileNodes.content)
 
+    def fingerprint(self) -> bytes:
+        # Stable across processes, so it can be used as a key on disk
+        if self.digest is None:
+            data = array("q", self.node_list).tobytes()
+            object.__setattr__(self, "digest", blake2b(data, digest_size=16).digest())
+        return cast(bytes, self.digest)
+
 
 @dataclass(slots=True, frozen=True)
 class FileReprEdit(FileRepr):
@@ -64,33 +269,374 @@ class FileReprEdit(FileRepr):
     def __len__(self):
         return len(self.node_list)
 
+    def _allocate(self, max_uid: int) -> tuple[int, int]:
+        # First uid and step of the uids of an insert
+        return max_uid + 1, 1
+
+    def edit(self) -> EditSession:
+        return EditSession(self)
+
     def insert(self, offset, size):
         if offset < 0 or offset > len(self):
             raise IndexError()
+        if size == 0:
+            return self
         node_list = self.node_list
         uid = self.max_uid + 1
-        if size == 0:
-            return FileReprEdit(list(node_list), uid)
         node_list = (
             node_list[:offset] + list(range(uid, uid + size)) + node_list[offset:]
         )
-        return FileReprEdit(node_list, uid + size - 1)
+        return attr.evolve(self, node_list=node_list, max_uid=uid + size - 1)
 
     def delete(self, offset, size):
         node_list = self.node_list
-        return FileReprEdit(
-            node_list[:offset] + node_list[offset + size :],
-            self.max_uid,
+        return attr.evolve(
+            self,
+            node_list=node_list[:offset] + node_list[offset + size :],
         )
 
 
-# State is something like a CRDT
 @dataclass(slots=True, frozen=True)
+class ReplicaFileReprEdit(FileReprEdit):
+    # Allocates packed uids, so replicas can edit concurrently without sharing a counter.
+    # max_uid has to be bumped with observe() when changes of other replicas are merged.
+    replica: int
+    replica_bits: int = REPLICA_BITS
+
+    def __attrs_post_init__(self):
+        assert 0 <= self.replica < 1 << self.replica_bits
+
+    def observe(self, uid: int) -> ReplicaFileReprEdit:
+        if uid <= self.max_uid:
+            return self
+        return attr.evolve(self, max_uid=uid)
+
+    def insert(self, offset, size):
+        if offset < 0 or offset > len(self):
+            raise IndexError()
+        if size == 0:
+            return self
+        uids = _replica_uids(self.max_uid, size, self.replica, self.replica_bits)
+        node_list = self.node_list
+        return attr.evolve(
+            self,
+            node_list=node_list[:offset] + uids + node_list[offset:],
+            max_uid=uids[-1],
+        )
+
+    def _allocate(self, max_uid: int) -> tuple[int, int]:
+        bits = self.replica_bits
+        return pack_uid(unpack_uid(max_uid, bits)[0] + 1, self.replica, bits), 1 << bits
+
+
+class EditSession(object):
+    # Batched edits on a piece table, O(log pieces) per edit instead of O(n). finish()
+    # builds the FileReprEdit once.
+    __slots__ = ("file_", "table", "max_uid")
+
+    def __init__(self, file_: FileReprEdit):
+        self.file_ = file_
+        self.table = PieceTable.from_node_list(file_.node_list)
+        self.max_uid = file_.max_uid
+
+    def __len__(self):
+        return len(self.table)
+
+    def insert(self, offset: int, size: int) -> EditSession:
+        if offset < 0 or offset > len(self):
+            raise IndexError()
+        if size > 0:
+            start, step = self.file_._allocate(self.max_uid)
+            self.table = self.table.insert(offset, start, step, size)
+            self.max_uid = start + (size - 1) * step
+        return self
+
+    def delete(self, offset: int, size: int) -> EditSession:
+        self.table = self.table.delete(offset, size)
+        return self
+
+    def finish(self) -> FileReprEdit:
+        return attr.evolve(
+            self.file_, node_list=pvector(self.table), max_uid=self.max_uid
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class Conflict(object):
+    # Lines start:end of the linearized file are in conflict, sides are ranges of the
+    # file in the same coordinates. base are all hidden nodes between the branch point
+    # and the join, including lines deleted before the sides diverged. It is not the
+    # merge base, the graph does not tell when a line was hidden, see render(since=).
+    start: int
+    end: int
+    sides: PVector[tuple[int, int]]
+    base: PVector[int]
+
+    sides = cast(PVector[tuple[int, int]], attr.ib(converter=pvector))
+    base = cast(PVector[int], attr.ib(converter=pvector))
+
+
+@dataclass(slots=True, frozen=True)
+class Linearization(object):
+    file_: FileRepr
+    conflicts: PVector[Conflict]
+
+    conflicts = cast(PVector[Conflict], attr.ib(converter=pvector))
+
+
+def _conflicts(seq, lo, up, hidden):
+    # The visible nodes are conflict free if they form a chain, so every seq[t + 1] is
+    # reachable from seq[t]. Paths only through hidden nodes that bypass a part of the
+    # chain were replaced and do not matter. If seq[t + 1] is not reachable from seq[t]
+    # they are on parallel paths, the conflict reaches back to the nearest predecessor
+    # of seq[t + 1] and forward to the nearest successor of seq[t]. seq[p] is file line
+    # p - 1.
+    gaps = core_gaps(seq, lo)
+    regions = [[up[seq[t + 1]], min(lo[seq[t]], len(seq) - 1)] for t in gaps]
+    regions.sort()
+    merged: list[list[int]] = []
+    for region in regions:
+        if merged and region[0] < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], region[1])
+        else:
+            merged.append(region)
+    hidden_pos = [c for c, _ in hidden]
+    gap = 0
+    for fork, join in merged:
+        starts = [fork]
+        while gap < len(gaps) and gaps[gap] < join - 1:
+            if gaps[gap] > fork:
+                starts.append(gaps[gap])
+            gap += 1
+        sides = zip(starts, starts[1:] + [join - 1])
+        base = hidden[bisect_left(hidden_pos, fork) : bisect_left(hidden_pos, join)]
+        yield Conflict(fork, join - 1, sides, [h for _, h in base])
+
+
+def linearize(
+    nodes: Sequence[bool],
+    edges: Iterable[Edge],
+    start: int = _IntFileNodes.start,
+    end: int = _IntFileNodes.end,
+) -> Linearization:
+    seq, lo, up, hidden = order(nodes, edges, start, end)
+    return Linearization(FileRepr(seq[1:-1]), list(_conflicts(seq, lo, up, hidden)))
+
+
+def _adjacency(edges: Iterable[Edge]):
+    outgoing: dict[int, list[int]] = {}
+    incoming: dict[int, list[int]] = {}
+    for from_, to in edges:
+        outgoing.setdefault(from_, []).append(to)
+        incoming.setdefault(to, []).append(from_)
+    return outgoing, incoming
+
+
+def _reach(adjacent: dict[int, list[int]], start: int) -> set[int]:
+    seen = {start}
+    stack = [start]
+    while stack:
+        for child in adjacent.get(stack.pop(), ()):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return seen
+
+
+def _run(outgoing, incoming, first: int, last: int) -> set[int]:
+    # The nodes on paths from first to last, including hidden ones
+    forward = _reach(outgoing, first)
+    if last not in forward:
+        raise InconsistentError("{0} does not reach {1}".format(first, last))
+    return forward & _reach(incoming, last)
+
+
+def _move_edges(edges: Iterable[Edge], change: Move) -> tuple[set[Edge], set[Edge]]:
+    # The edges a Move removes and adds: detaches the run, bridges the gap it leaves
+    # and links it between predecessor and successor. Edges between the run and the
+    # rest of the graph, for example of deleted lines bypassing a part of the run, are
+    # bridged as well, so they stay at the old position. Costs O(edges) for the
+    # adjacency.
+    lines = change.lines
+    outgoing, incoming = _adjacency(edges)
+    run = _run(outgoing, incoming, lines[0], lines[-1])
+    pre = change.predecessor
+    suc = change.successor
+    if not run.issuperset(lines) or pre in run or suc in run:
+        raise InconsistentError("cannot move {0!r}".format(change))
+    removed = {(pre, suc)}
+    sources = set()
+    targets = set()
+    for node in run:
+        for source in incoming.get(node, ()):
+            if source not in run:
+                removed.add((source, node))
+                sources.add(source)
+        for target in outgoing.get(node, ()):
+            if target not in run:
+                removed.add((node, target))
+                targets.add(target)
+    added = {(x, y) for x in sources for y in targets}
+    added.discard((pre, suc))
+    added.add((pre, lines[0]))
+    added.add((lines[-1], suc))
+    return removed - added, added - removed
+
+
+def _check_graph(nodes: Sequence[bool], edges: Iterable[Edge]):
+    # Returns (outgoing, indegree), every edge references a known node
+    size = len(nodes)
+    outgoing: dict[int, list[int]] = {}
+    indegree: dict[int, int] = {}
+    for from_, to in edges:
+        if not (0 <= from_ < size and 0 <= to < size):
+            raise InconsistentError(
+                "edge {0} references unknown nodes".format((from_, to))
+            )
+        outgoing.setdefault(from_, []).append(to)
+        indegree[to] = indegree.get(to, 0) + 1
+    return outgoing, indegree
+
+
+def _check_order(graph, outgoing, indegree, start, end):
+    for node in graph:
+        if node != start and not indegree.get(node):
+            raise InconsistentError("{0} is not reachable from start".format(node))
+        if node != end and node not in outgoing:
+            raise InconsistentError("end is not reachable from {0}".format(node))
+    ready = [start]
+    done = 0
+    while ready:
+        node = ready.pop()
+        done += 1
+        for child in outgoing.get(node, ()):
+            indegree[child] -= 1
+            if not indegree[child]:
+                ready.append(child)
+    if done != len(graph):
+        raise InconsistentError("the graph has a cycle")
+
+
+def validate(nodes: Sequence[bool], edges: Iterable[Edge], max_node: int):
+    # O(nodes + edges): nodes matches max_node, the graph is acyclic, start is the only
+    # source and end the only sink, so every node is on a path from start to end, and
+    # every visible line is in the graph.
+    start = _IntFileNodes.start
+    end = _IntFileNodes.end
+    if len(nodes) != max(max_node, end) + 1:
+        raise InconsistentError("max_node does not match nodes")
+    if not (nodes[start] and nodes[end]):
+        raise InconsistentError("start and end have to be visible")
+    outgoing, indegree = _check_graph(nodes, edges)
+    if indegree.get(start) or outgoing.get(end):
+        raise InconsistentError("edges into start or out of end")
+    graph = set(outgoing) | set(indegree)
+    graph.add(start)
+    graph.add(end)
+    _check_order(graph, outgoing, indegree, start, end)
+    for node in range(FileNodes.content, len(nodes)):
+        if nodes[node] and node not in graph:
+            raise InconsistentError("visible line {0} is not in the graph".format(node))
+
+
+def _keeps_changes(history) -> bool:
+    # False for history.CountingHistory
+    return getattr(history, "keeps_changes", True)
+
+
+def _find(history, creators, hiders, change: Change) -> list[int]:
+    # History indices of change
+    if isinstance(change, Insert):
+        index = creators.get(change.lines[0])
+        if index is not None and history[index] == change:
+            return [index]
+        return []
+    elif isinstance(change, Delete):
+        return [x for x in hiders.get(change.line, ()) if history[x] == change]
+    raise ValueError("only Insert and Delete can be reverted")
+
+
+# State is something like a CRDT
+@dataclass(slots=True, frozen=True, hash=False)
 class State(object):
     nodes: PVector[bool]
     edges: PSet[Edge]
     max_node: int
     history: PVector[Change]
+    # Incremental fingerprints, calculated from scratch if not passed
+    fingerprint: int
+    history_fingerprint: int
+
+    # Provenance index into history: uid -> Insert, uid -> Deletes and the reverted
+    # changes. Also built from history if not passed.
+    creators: PMap[int, int]
+    hiders: PMap[int, PSet[int]]
+    reverted: PSet[int]
+    tombstones: PSet[int]
+    positions: Optional[PositionIndex]
+
+    fingerprint = cast(int, attr.ib(default=None, eq=False))
+    history_fingerprint = cast(int, attr.ib(default=None, eq=False))
+    creators = cast(PMap[int, int], attr.ib(default=None, eq=False))
+    hiders = cast(PMap[int, PSet[int]], attr.ib(default=None, eq=False))
+    reverted = cast(PSet[int], attr.ib(default=None, eq=False))
+    # Hidden nodes of the graph that are not in the provenance index, all of them with a
+    # CountingHistory. Hidden nodes in neither are holes in the uid space, their uids
+    # are still free.
+    tombstones = cast(PSet[int], attr.ib(default=None, eq=False))
+    # Position index of the visible lines, built on first use. Changes reset it, except
+    # the offset based edits that update it.
+    positions = cast(Optional[PositionIndex], attr.ib(default=None, eq=False))
+
+    def __attrs_post_init__(self):
+        if self.fingerprint is None:
+            fingerprint = graph_fingerprint(self.nodes, self.edges)
+            object.__setattr__(self, "fingerprint", fingerprint)
+        if self.history_fingerprint is None:
+            fingerprint = 0
+            for change in self.history:
+                fingerprint = chain_fingerprint(fingerprint, change)
+            object.__setattr__(self, "history_fingerprint", fingerprint)
+        if self.creators is None:
+            self._index_history()
+        if self.tombstones is None:
+            tombstones = set()
+            nodes = self.nodes
+            size = len(nodes)
+            for edge in self.edges:
+                for node in edge:
+                    if node < size and not nodes[node] and not self._known(node):
+                        tombstones.add(node)
+            object.__setattr__(self, "tombstones", _pset(tombstones))
+
+    def _known(self, line: int) -> bool:
+        # True for lines created or hidden by a change in history
+        return line in self.creators or line in self.hiders
+
+    def _index_history(self):
+        creators: dict[int, int] = {}
+        hiders: dict[int, set[int]] = {}
+        reverted: set[int] = set()
+        history = self.history
+        # A CountingHistory has no provenance
+        changes = history if _keeps_changes(history) else ()
+        for index, change in enumerate(changes):
+            if isinstance(change, Insert):
+                for line in change.lines:
+                    creators[line] = index
+            elif isinstance(change, Delete):
+                hiders.setdefault(change.line, set()).add(index)
+            elif isinstance(change, Revert):
+                for target in change.changes:
+                    reverted.update(_find(history, creators, hiders, target))
+        object.__setattr__(self, "creators", pmap(creators))
+        object.__setattr__(
+            self, "hiders", pmap({k: pset(v) for k, v in hiders.items()})
+        )
+        object.__setattr__(self, "reverted", _pset(reverted))
+
+    def __hash__(self):
+        return self.fingerprint
 
     @staticmethod
     def _node_list_to_edges(
@@ -106,13 +652,31 @@ class State(object):
         yield (prev, end)
 
     @classmethod
-    def from_graph(cls, nodes: Iterable[bool], edges: Iterable[Edge]):
-        # TODO add consistency check
+    def from_graph(
+        cls, nodes: Iterable[bool], edges: Iterable[Edge], check=True, history=None
+    ):
+        # Pass check=False only for graphs that were validated before. history is an
+        # empty sequence with an append returning a new sequence, like ColumnarHistory.
         nodes = pvector(nodes)
-        return cls(nodes, pset(edges), len(nodes) - 1, pvector())
+        edges = _pset(edges)
+        max_node = len(nodes) - 1
+        if check:
+            validate(nodes, edges, max_node)
+        if history is None:
+            history = pvector()
+        return cls(nodes, edges, max_node, history)
+
+    def replay(self, changes: Iterable[Change]) -> State:
+        state = self
+        for change in changes:
+            state = change.apply(state)
+        return state
+
+    def validate(self):
+        validate(self.nodes, self.edges, self.max_node)
 
     @classmethod
-    def from_file(cls, file_: FileRepr):
+    def from_file(cls, file_: FileRepr, history=None):
         node_list = file_.node_list
         max_node = -1
         if node_list:
@@ -125,10 +689,69 @@ class State(object):
             nodes = nodes.set(i, True)
         for i in node_list:
             nodes = nodes.set(i, True)
+        if history is None:
+            history = pvector()
         return cls(
-            nodes, pset(State._node_list_to_edges(node_list)), max_node, pvector()
+            nodes,
+            _pset(State._node_list_to_edges(node_list)),
+            max_node,
+            history,
+            tombstones=pset(),
         )
 
+    def linearize(self) -> Linearization:
+        return linearize(self.nodes, self.edges)
+
+    def to_file(self) -> FileRepr:
+        linear = self.linearize()
+        if linear.conflicts:
+            raise ConflictError(linear)
+        return linear.file_
+
+    def position_index(self) -> PositionIndex:
+        # Raises ConflictError like to_file
+        if self.positions is None:
+            positions = PositionIndex.from_node_list(self.to_file().node_list)
+            object.__setattr__(self, "positions", positions)
+        return self.positions
+
+    def insert_at(
+        self,
+        offset: int,
+        size: int,
+        replica: Optional[int] = None,
+        replica_bits: int = REPLICA_BITS,
+    ) -> State:
+        # Inserts size new lines at the visible position offset. Without replica the uids
+        # follow the largest one in the graph, with concurrent writers they are packed
+        # like ReplicaFileReprEdit does.
+        positions = self.position_index()
+        if offset < 0 or offset > len(positions):
+            raise IndexError("position out of range")
+        if size <= 0:
+            return self
+        pre = positions[offset - 1] if offset else _IntFileNodes.start
+        suc = _IntFileNodes.end
+        if offset < len(positions):
+            suc = positions[offset]
+        if replica is None:
+            first = max(len(self.nodes), FileNodes.content)
+            lines = pvector(range(first, first + size))
+        else:
+            lines = pvector(_replica_uids(self.max_node, size, replica, replica_bits))
+        state = self.insert(Insert(pre, lines, suc))
+        return attr.evolve(state, positions=positions.insert(offset, lines))
+
+    def delete_at(self, offset: int, size: int) -> State:
+        positions = self.position_index()
+        lines = positions.lines(offset, size)
+        if not lines:
+            return self
+        state = self
+        for line in lines:
+            state = state.delete(Delete(line))
+        return attr.evolve(state, positions=positions.delete(offset, size))
+
     def to_user_edges(self) -> Iterable[Edge]:
         c = FileNodes.content
         for e in self.edges:
@@ -137,23 +760,127 @@ class State(object):
     def to_user_nodes(self) -> Iterable[bool]:
         return self.nodes[FileNodes.content :]
 
+    def created_by(self, uid: int) -> Optional[Change]:
+        index = self.creators.get(uid)
+        if index is None:
+            return None
+        return self.history[index]
+
+    def hidden_by(self, uid: int) -> list[Change]:
+        history = self.history
+        return [history[x] for x in sorted(self.hiders.get(uid, ()))]
+
+    def _visible(self, line: int, reverted: PSet[int]) -> bool:
+        if self.creators.get(line) in reverted:
+            return False
+        for index in self.hiders.get(line, ()):
+            if index not in reverted:
+                return False
+        return True
+
     def delete(self, change: Delete) -> State:
-        return State(
-            self.nodes.set(change.line, False),
-            self.edges,
-            self.max_node,
-            self.history.append(change),
+        line = change.line
+        fingerprint = self.fingerprint
+        tombstones = self.tombstones
+        hiders = self.hiders
+        if _keeps_changes(self.history):
+            index = len(self.history)
+            hiders = hiders.set(line, hiders.get(line, pset()).add(index))
+        elif self.nodes[line]:
+            tombstones = tombstones.add(line)
+        if self.nodes[line]:
+            fingerprint = (fingerprint - node_fingerprint(line)) & _mask
+        return attr.evolve(
+            self,
+            nodes=self.nodes.set(line, False),
+            history=self.history.append(change),
+            fingerprint=fingerprint,
+            history_fingerprint=chain_fingerprint(self.history_fingerprint, change),
+            hiders=hiders,
+            tombstones=tombstones,
+            positions=None,
+        )
+
+    def transaction(self) -> Transaction:
+        if _keeps_changes(self.history):
+            raise ValueError("transactions need a State with a CountingHistory")
+        return Transaction(self)
+
+    def revert(self, change: Revert) -> State:
+        # Only the nodes of the reverted changes are touched, the graph is not changed
+        history = self.history
+        reverted = self.reverted
+        lines = []
+        for target in change.changes:
+            indices = _find(history, self.creators, self.hiders, target)
+            if not indices:
+                raise ValueError("{0!r} is not in history".format(target))
+            reverted = reverted.update(indices)
+            if isinstance(target, Insert):
+                lines.extend(target.lines)
+            else:
+                lines.append(target.line)
+        nodes = self.nodes.evolver()
+        fingerprint = self.fingerprint
+        for line in lines:
+            visible = self._visible(line, reverted)
+            if visible != nodes[line]:
+                nodes[line] = visible
+                if visible:
+                    fingerprint += node_fingerprint(line)
+                else:
+                    fingerprint -= node_fingerprint(line)
+        return attr.evolve(
+            self,
+            nodes=nodes.persistent(),
+            history=history.append(change),
+            fingerprint=fingerprint & _mask,
+            history_fingerprint=chain_fingerprint(self.history_fingerprint, change),
+            reverted=reverted,
+            positions=None,
+        )
+
+    def revert_indices(self, indices: Iterable[int]) -> State:
+        history = self.history
+        return self.revert(Revert([history[x] for x in indices]))
+
+    def move(self, change: Move) -> State:
+        removed, added = _move_edges(self.edges, change)
+        return self._relink(change, removed, added)
+
+    def _relink(self, change: Change, removed: set[Edge], added: set[Edge]) -> State:
+        edges = self.edges
+        fingerprint = self.fingerprint
+        for edge in removed:
+            if edge in edges:
+                edges = edges.remove(edge)
+                fingerprint -= edge_fingerprint(edge)
+        for edge in added:
+            if edge not in edges:
+                edges = edges.add(edge)
+                fingerprint += edge_fingerprint(edge)
+        return attr.evolve(
+            self,
+            edges=edges,
+            history=self.history.append(change),
+            fingerprint=fingerprint & _mask,
+            history_fingerprint=chain_fingerprint(self.history_fingerprint, change),
+            positions=None,
         )
 
     def insert(self, change: Insert) -> State:
         nodes = self.nodes
         lines = change.lines
-        assert min(lines) > self.max_node
-        max_node = max(lines)
-        nodes = nodes.extend([False] * (max_node - self.max_node))
-        assert max_node <= len(nodes)
+        max_node = max(self.max_node, max(lines))
+        nodes = nodes.extend([False] * (max_node + 1 - len(nodes)))
+        fingerprint = self.fingerprint
+        tombstones = self.tombstones
         for line in lines:
+            # Replicas allocate interleaved uids, so lines below max_node are fine as
+            # long as they are not in the graph, visible or not
+            assert not nodes[line] and line not in tombstones and not self._known(line)
             nodes = nodes.set(line, True)
+            fingerprint += node_fingerprint(line)
         inserts = list(
             self._node_list_to_edges(
                 lines,
@@ -162,23 +889,189 @@ class State(object):
             )
         )
         edges = self.edges
-        try:
-            edges = edges.remove((change.predecessor, change.successor))
-        except KeyError:
-            pass
+        replaced = (change.predecessor, change.successor)
+        if replaced in edges:
+            edges = edges.remove(replaced)
+            fingerprint -= edge_fingerprint(replaced)
+        for edge in inserts:
+            if edge not in edges:
+                fingerprint += edge_fingerprint(edge)
         edges = edges.update(inserts)
-        return State(nodes, edges, max_node, self.history.append(change))
+        creators = self.creators
+        if _keeps_changes(self.history):
+            index = len(self.history)
+            evolver = creators.evolver()
+            for line in lines:
+                evolver[line] = index
+            creators = evolver.persistent()
+        return attr.evolve(
+            self,
+            nodes=nodes,
+            edges=edges,
+            max_node=max_node,
+            history=self.history.append(change),
+            fingerprint=fingerprint & _mask,
+            history_fingerprint=chain_fingerprint(self.history_fingerprint, change),
+            creators=creators,
+            positions=None,
+        )
+
+
+class Transaction(object):
+    # Applies Inserts, Deletes and Moves to a State without history in place: nodes
+    # are changed in an evolver, edges are collected in sets. finish() builds the State
+    # once, the State the transaction started from is not changed.
+    __slots__ = (
+        "state",
+        "nodes",
+        "added",
+        "removed",
+        "max_node",
+        "tombstones",
+        "fingerprint",
+        "history_fingerprint",
+        "count",
+    )
+
+    def __init__(self, state: State):
+        self.state = state
+        self.nodes = state.nodes.evolver()
+        self.added: set[Edge] = set()
+        self.removed: set[Edge] = set()
+        self.max_node = state.max_node
+        # New tombstones, they are only added in a transaction
+        self.tombstones: set[int] = set()
+        self.fingerprint = state.fingerprint
+        self.history_fingerprint = state.history_fingerprint
+        self.count = 0
+
+    def _has_edge(self, edge: Edge) -> bool:
+        if edge in self.added:
+            return True
+        return edge in self.state.edges and edge not in self.removed
+
+    def _add_edge(self, edge: Edge):
+        if not self._has_edge(edge):
+            self.fingerprint += edge_fingerprint(edge)
+            self.removed.discard(edge)
+            if edge not in self.state.edges:
+                self.added.add(edge)
+
+    def _remove_edge(self, edge: Edge):
+        if self._has_edge(edge):
+            self.fingerprint -= edge_fingerprint(edge)
+            self.added.discard(edge)
+            if edge in self.state.edges:
+                self.removed.add(edge)
+
+    def insert(self, change: Insert):
+        nodes = self.nodes
+        lines = change.lines
+        self.max_node = max(self.max_node, max(lines))
+        nodes.extend([False] * (self.max_node + 1 - len(nodes)))
+        for line in lines:
+            assert not nodes[line] and line not in self.tombstones
+            assert line not in self.state.tombstones
+            nodes[line] = True
+            self.fingerprint += node_fingerprint(line)
+        self._remove_edge((change.predecessor, change.successor))
+        for edge in State._node_list_to_edges(
+            lines, change.predecessor, change.successor
+        ):
+            self._add_edge(edge)
+
+    def delete(self, change: Delete):
+        line = change.line
+        if self.nodes[line]:
+            self.fingerprint -= node_fingerprint(line)
+            self.nodes[line] = False
+            self.tombstones.add(line)
+
+    def move(self, change: Move):
+        gone = self.removed
+        edges = itertools.chain(
+            (x for x in self.state.edges if x not in gone), self.added
+        )
+        removed, added = _move_edges(edges, change)
+        for edge in removed:
+            self._remove_edge(edge)
+        for edge in added:
+            self._add_edge(edge)
+
+    def apply(self, change: Change) -> Transaction:
+        if isinstance(change, Insert):
+            self.insert(change)
+        elif isinstance(change, Delete):
+            self.delete(change)
+        elif isinstance(change, Move):
+            self.move(change)
+        else:
+            raise TypeError("transactions only apply Inserts, Deletes and Moves")
+        self.history_fingerprint = chain_fingerprint(self.history_fingerprint, change)
+        self.count += 1
+        return self
+
+    def finish(self) -> State:
+        state = self.state
+        edges = state.edges.evolver()
+        for edge in self.removed:
+            edges.remove(edge)
+        for edge in self.added:
+            edges.add(edge)
+        return attr.evolve(
+            state,
+            nodes=self.nodes.persistent(),
+            edges=edges.persistent(),
+            max_node=self.max_node,
+            history=state.history.add(self.count),
+            tombstones=state.tombstones.update(self.tombstones),
+            fingerprint=self.fingerprint & _mask,
+            history_fingerprint=self.history_fingerprint,
+            positions=None,
+        )
+
+
+def _unchecked_constructor(cls: type):
+    # Generates a constructor like the __init__ of attrs without __attrs_post_init__.
+    # Fields are set through their slot descriptors, which skips the frozen
+    # __setattr__.
+    fields = attr.fields(cls)
+    namespace: dict[str, Any] = {"new": object.__new__, "cls": cls}
+    code = ["def unchecked({0}):".format(", ".join(x.name for x in fields))]
+    code.append("    self = new(cls)")
+    for field in fields:
+        value = field.name
+        if field.converter is not None:
+            namespace["convert_" + field.name] = field.converter
+            value = "convert_{0}({0})".format(field.name)
+        namespace["set_" + field.name] = getattr(cls, field.name).__set__
+        code.append("    set_{0}(self, {1})".format(field.name, value))
+    code.append("    return self")
+    exec("\n".join(code), namespace)
+    return namespace["unchecked"]
+
+
+_unchecked: dict[type, Any] = {}
 
 
 @dataclass(slots=True, frozen=True)
 class Change(object):
+    @classmethod
+    def unchecked(cls, *args):
+        # Skips the checks in __attrs_post_init__, for replaying validated change logs
+        constructor = _unchecked.get(cls)
+        if constructor is None:
+            constructor = _unchecked[cls] = _unchecked_constructor(cls)
+        return constructor(*args)
+
     def apply(self, state: State) -> State:
         raise NotImplementedError()
 
+    def fingerprint(self) -> int:
+        raise NotImplementedError()
+
     @classmethod
-    def pre_suc(_, ag, left, right):
-        pre = _IntFileNodes.start
-        suc = _IntFileNodes.end
+    def pre_suc(_, ag, left, right, pre=_IntFileNodes.start, suc=_IntFileNodes.end):
         if left:
             pre = ag[left - 1]
         if right != len(ag):
@@ -186,44 +1079,102 @@ class Change(object):
         return pre, suc
 
     @classmethod
-    def from_diff(cls, a: FileRepr, b: FileRepr):
-        a_node_list = a.node_list
-        b_node_list = b.node_list
-        for (
-            ct,
-            a_left,
-            a_right,
-            b_left,
-            b_right,
-        ) in get_diff(a_node_list, b_node_list):
-            if ct == "insert":
-                pre, suc = cls.pre_suc(
-                    a_node_list,
-                    a_left,
-                    a_left,
-                )
-                yield Insert(
-                    pre,
-                    b_node_list[b_left:b_right],
-                    suc,
-                )
-            elif ct == "delete":
-                for line in a_node_list[a_left:a_right]:
-                    yield Delete(line)
-            elif ct == "replace":
+    def _place(cls, lines, pre, suc, removed, moved):
+        # Splits lines into runs of new lines and of lines moved together, each run is
+        # placed after the previous one
+        run = [lines[0]]
+        for line in lines[1:]:
+            prev = run[-1]
+            if line in moved:
+                same = prev in moved and removed[line] == removed[prev] + 1
+            else:
+                same = prev not in moved
+            if same:
+                run.append(line)
+                continue
+            yield cls._run_change(pre, run, suc, moved)
+            pre = prev
+            run = [line]
+        yield cls._run_change(pre, run, suc, moved)
+
+    @classmethod
+    def _run_change(cls, pre, run, suc, moved):
+        if run[0] in moved:
+            return Move(pre, run, suc)
+        return Insert(pre, run, suc)
+
+    @classmethod
+    def _moved(cls, opcodes, a_node_list, b_node_list):
+        # Positions of the lines removed from a and the removed lines inserted in b
+        removed = {}
+        for ct, a_left, a_right, _, _ in opcodes:
+            if ct in ("delete", "replace"):
+                for index in range(a_left, a_right):
+                    removed[a_node_list[index]] = index
+        moved = set()
+        for ct, _, _, b_left, b_right in opcodes:
+            if ct in ("insert", "replace"):
+                moved.update(x for x in b_node_list[b_left:b_right] if x in removed)
+        return removed, moved
+
+    @classmethod
+    def _changes(cls, a_node_list, b_node_list, start, end, moves=False):
+        # With moves, lines of a that appear in an insert of b are moved instead of
+        # deleted and inserted, so they keep their uids. Without, they are an error, a
+        # known uid can't be inserted again.
+        opcodes = get_diff(a_node_list, b_node_list)
+        removed, moved = cls._moved(opcodes, a_node_list, b_node_list)
+        if moved and not moves:
+            raise ValueError("line {0} is moved, pass moves=True".format(min(moved)))
+        for ct, a_left, a_right, b_left, b_right in opcodes:
+            if ct in ("delete", "replace"):
                 for line in a_node_list[a_left:a_right]:
-                    yield Delete(line)
-                pre, suc = cls.pre_suc(
-                    a_node_list,
-                    a_left,
-                    a_right,
-                )
-                yield Insert(
-                    pre,
-                    b_node_list[b_left:b_right],
-                    suc,
+                    if line not in moved:
+                        yield Delete(line)
+            if ct in ("insert", "replace"):
+                pre, suc = cls.pre_suc(a_node_list, a_left, a_right, start, end)
+                yield from cls._place(
+                    b_node_list[b_left:b_right], pre, suc, removed, moved
                 )
 
+    @classmethod
+    def from_diff(cls, a: FileRepr, b: FileRepr, moves: bool = False):
+        # Moves do not commute with concurrent edits anchored at the old boundaries of
+        # the moved lines, replicas that apply them in different orders diverge. Only
+        # pass moves=True if the changes are not merged with concurrent ones.
+        return cls._changes(
+            a.node_list, b.node_list, _IntFileNodes.start, _IntFileNodes.end, moves
+        )
+
+    @classmethod
+    def from_diff_stream(cls, a: Iterable[int], b: Iterable[int]):
+        # Changes from node list a to node list b, yielded while they are read. Moves
+        # are not supported: a line moved within a gap raises like in from_diff, a line
+        # moved across an anchor is deleted in one gap and inserted in another. The
+        # uids deleted and inserted so far are kept, so that raises ValueError too,
+        # before the insert is yielded. If the insert comes first, the ValueError is
+        # raised at the delete, the insert was yielded already and is rejected by
+        # State.insert. Memory is bounded by the largest gap plus the changed lines.
+        pre = _IntFileNodes.start
+        deleted: set[int] = set()
+        inserted: set[int] = set()
+        for _, a_items, _, b_items, anchor in _anchored(a, b):
+            if a_items or b_items:
+                suc = _IntFileNodes.end if anchor is _end else anchor
+                for change in cls._changes(a_items, b_items, pre, suc):
+                    if isinstance(change, Delete):
+                        moved = change.line in inserted
+                        deleted.add(change.line)
+                    else:
+                        moved = not deleted.isdisjoint(change.lines)
+                        inserted.update(change.lines)
+                    if moved:
+                        raise ValueError(
+                            "{0!r} moves a line across an anchor".format(change)
+                        )
+                    yield change
+            pre = anchor
+
 
 @dataclass(slots=True, frozen=True)
 class Insert(Change):
@@ -255,6 +1206,12 @@ class Insert(Change):
     def apply(self, state: State) -> State:
         return state.insert(self)
 
+    def fingerprint(self) -> int:
+        fingerprint = _mix(self.predecessor)
+        for line in self.lines:
+            fingerprint = _mix(fingerprint ^ line)
+        return _mix(fingerprint ^ self.successor)
+
 
 @dataclass(slots=True, frozen=True)
 class Delete(Change):
@@ -273,3 +1230,55 @@ class Delete(Change):
 
     def apply(self, state: State) -> State:
         return state.delete(self)
+
+    def fingerprint(self) -> int:
+        return _mix(_mix(self.line) ^ _delete_salt)
+
+
+@dataclass(slots=True, frozen=True)
+class Move(Change):
+    # Relinks the run of lines, which has to be contiguous in the linearization, between
+    # predecessor and successor. Concurrent edits inside the run move with it, edits
+    # anchored at the old boundaries of the run do not commute with the move, so
+    # Change.from_diff only yields Moves if asked to.
+    predecessor: int
+    lines: PVector[int]
+    successor: int
+
+    lines = cast(PVector[int], attr.ib(converter=pvector))
+
+    def __attrs_post_init__(self):
+        assert len(self.lines) > 0
+        assert self.predecessor != self.successor
+        assert self.predecessor not in self.lines
+        assert self.successor not in self.lines
+
+    def apply(self, state: State) -> State:
+        return state.move(self)
+
+    def fingerprint(self) -> int:
+        fingerprint = _mix(self.predecessor ^ _move_salt)
+        for line in self.lines:
+            fingerprint = _mix(fingerprint ^ line)
+        return _mix(fingerprint ^ self.successor)
+
+
+@dataclass(slots=True, frozen=True)
+class Revert(Change):
+    changes: PVector[Change]
+
+    changes = cast(PVector[Change], attr.ib(converter=pvector))
+
+    def __attrs_post_init__(self):
+        assert len(self.changes) > 0
+        for change in self.changes:
+            assert isinstance(change, (Insert, Delete))
+
+    def apply(self, state: State) -> State:
+        return state.revert(self)
+
+    def fingerprint(self) -> int:
+        fingerprint = _revert_salt
+        for change in self.changes:
+            fingerprint = _mix(fingerprint ^ change.fingerprint())
+        return fingerprint
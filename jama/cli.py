@@ -1,2 +1,41 @@
+import os
+import sys
+
+import click
+import pygit2  # type: ignore
+
+from .blame import blame as blame_lines
+from .git import cached_replay, replay
+from .store import Store
+
+# Directory in the git directory where blame keeps the replayed histories
+cache_name = "jama"
+
+
+@click.group()
 def run():
-    print("jama")
+    pass
+
+
+@run.command()
+@click.argument("path")
+@click.option("--rev", default="HEAD", help="Revision to blame.")
+@click.option("--repo", "repo_path", default=".", help="Path inside the repository.")
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Keep the replayed history, later calls only replay the new commits.",
+)
+def blame(path, rev, repo_path, cache):
+    # Without the cache every call replays the whole first-parent history of path
+    repo = pygit2.Repository(pygit2.discover_repository(repo_path))
+    if cache:
+        with Store(os.path.join(repo.path, cache_name)) as store:
+            result = cached_replay(repo, store, path, rev)
+    else:
+        result = replay(repo, path, rev)
+    out = sys.stdout.buffer
+    for number, line in enumerate(blame_lines(result.state, result.commits), start=1):
+        commit = (line.commit or "").encode("ascii")[:8]
+        out.write(b"%s %6d) %s" % (commit, number, result.content[line.uid]))
+    out.flush()
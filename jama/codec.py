@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Iterable, Union
+
+from .change import Change, Delete, Insert, Move, Revert
+
+# Binary encoding of changes: a kind byte followed by zigzag varints. Messages are framed
+# by a 4 byte big-endian length.
+
+_insert = 0
+_delete = 1
+_revert = 2
+_move = 3
+
+
+class DecodeError(Exception):
+    pass
+
+
+def write_varint(out: bytearray, value: int):
+    value = value << 1 if value >= 0 else ((-value) << 1) - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    try:
+        while True:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+    except IndexError:
+        raise DecodeError("truncated varint")
+    if value & 1:
+        return -((value + 1) >> 1), pos
+    return value >> 1, pos
+
+
+def _encode_run(out: bytearray, change: Union[Insert, Move]):
+    write_varint(out, change.predecessor)
+    write_varint(out, change.successor)
+    write_varint(out, len(change.lines))
+    for line in change.lines:
+        write_varint(out, line)
+
+
+def _decode_run(data: bytes, pos: int) -> tuple[int, list[int], int, int]:
+    predecessor, pos = read_varint(data, pos)
+    successor, pos = read_varint(data, pos)
+    size, pos = read_varint(data, pos)
+    lines = []
+    for _ in range(size):
+        line, pos = read_varint(data, pos)
+        lines.append(line)
+    return predecessor, lines, successor, pos
+
+
+def encode_change(out: bytearray, change: Change):
+    if isinstance(change, Insert):
+        out.append(_insert)
+        _encode_run(out, change)
+    elif isinstance(change, Move):
+        out.append(_move)
+        _encode_run(out, change)
+    elif isinstance(change, Delete):
+        out.append(_delete)
+        write_varint(out, change.line)
+    elif isinstance(change, Revert):
+        out.append(_revert)
+        write_varint(out, len(change.changes))
+        for target in change.changes:
+            encode_change(out, target)
+    else:
+        raise TypeError("cannot encode {0!r}".format(change))
+
+
+def _decode_fields(data: bytes, pos: int, check: bool) -> tuple[type, tuple, int]:
+    try:
+        kind = data[pos]
+    except IndexError:
+        raise DecodeError("truncated change")
+    pos += 1
+    if kind == _insert:
+        predecessor, lines, successor, pos = _decode_run(data, pos)
+        return Insert, (predecessor, lines, successor), pos
+    elif kind == _move:
+        predecessor, lines, successor, pos = _decode_run(data, pos)
+        return Move, (predecessor, lines, successor), pos
+    elif kind == _delete:
+        line, pos = read_varint(data, pos)
+        return Delete, (line,), pos
+    elif kind == _revert:
+        size, pos = read_varint(data, pos)
+        targets = []
+        for _ in range(size):
+            target, pos = decode_change(data, pos, check)
+            targets.append(target)
+        return Revert, (targets,), pos
+    raise DecodeError("unknown change kind {0}".format(kind))
+
+
+def decode_change(data: bytes, pos: int, check: bool = True) -> tuple[Change, int]:
+    # With check=False the changes are built unchecked, for trusted logs only
+    cls, fields, pos = _decode_fields(data, pos, check)
+    if not check:
+        return cls.unchecked(*fields), pos
+    try:
+        return cls(*fields), pos
+    except AssertionError:
+        raise DecodeError("invalid {0}".format(cls.__name__))
+
+
+def encode_changes(changes: Iterable[Change]) -> bytes:
+    out = bytearray()
+    for change in changes:
+        encode_change(out, change)
+    return bytes(out)
+
+
+def decode_changes(data: bytes, check: bool = True) -> Iterable[Change]:
+    pos = 0
+    while pos < len(data):
+        change, pos = decode_change(data, pos, check)
+        yield change
+
+
+def write_message(stream: BinaryIO, payload: bytes):
+    stream.write(len(payload).to_bytes(4, "big"))
+    stream.write(payload)
+    stream.flush()
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if data is None or len(data) != size:
+        raise DecodeError("stream closed")
+    return data
+
+
+def read_message(stream: BinaryIO) -> bytes:
+    size = int.from_bytes(_read_exactly(stream, 4), "big")
+    return _read_exactly(stream, size)
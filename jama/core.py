@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from typing import Iterable, Sequence
+
+# Graph kernels on plain int node ids, shared by jama.change and jama2. Sentinels are
+# ints too (start 0, end 1, lines from 2 on), so edges hash and compare as int tuples,
+# never as enum members. jama2 encodes its Nodes into this space.
+
+START = 0
+END = 1
+CONTENT = 2
+
+Edge = tuple[int, int]
+
+_on_stack = 1
+_done = 2
+
+
+class InconsistentError(Exception):
+    pass
+
+
+def successors(edges: Iterable[Edge]) -> dict[int, list[int]]:
+    # Successor lists in uid order
+    outgoing: dict[int, list[int]] = {}
+    for from_, to in edges:
+        children = outgoing.get(from_)
+        if children is None:
+            outgoing[from_] = [to]
+        else:
+            children.append(to)
+    for children in outgoing.values():
+        if len(children) > 1:
+            children.sort()
+    return outgoing
+
+
+def postorder(outgoing: dict[int, list[int]], start: int) -> list[int]:
+    # Successors are visited in uid order, so in reverse postorder parallel paths appear
+    # as contiguous blocks, the newest (highest uid) first, like in RGA. Iterative, the
+    # stack keeps the next child to visit of every node on it.
+    result = []
+    marks = {start: _on_stack}
+    stack = [start]
+    nexts = [0]
+    get = outgoing.get
+    empty: list[int] = []
+    while stack:
+        children = get(stack[-1], empty)
+        index = nexts[-1]
+        child = None
+        while index < len(children):
+            child = children[index]
+            index += 1
+            mark = marks.get(child)
+            if mark is None:
+                break
+            if mark == _on_stack:
+                raise InconsistentError("cycle at node {0}".format(child))
+            child = None
+        if child is None:
+            node = stack.pop()
+            nexts.pop()
+            marks[node] = _done
+            result.append(node)
+            continue
+        nexts[-1] = index
+        marks[child] = _on_stack
+        stack.append(child)
+        nexts.append(0)
+    return result
+
+
+def sequence(nodes: Sequence[bool], post: list[int], start: int, end: int):
+    # Visible nodes get their position in seq, hidden nodes remember the position of
+    # the last visible node before them.
+    seq = [start]
+    pos = {start: 0}
+    hidden = []
+    reached = False
+    for node in reversed(post):
+        if node == end:
+            reached = True
+        elif node == start:
+            continue
+        elif nodes[node]:
+            pos[node] = len(seq)
+            seq.append(node)
+        else:
+            hidden.append((len(seq) - 1, node))
+    if not reached:
+        raise InconsistentError("end is not reachable")
+    pos[end] = len(seq)
+    seq.append(end)
+    return seq, pos, hidden
+
+
+def order(
+    nodes: Sequence[bool], edges: Iterable[Edge], start: int = START, end: int = END
+):
+    # Returns seq, lo, up and hidden: lo is the position of the nearest visible
+    # successor and up of the nearest visible predecessor, reachable via hidden nodes
+    outgoing = successors(edges)
+    post = postorder(outgoing, start)
+    seq, pos, hidden = sequence(nodes, post, start, end)
+    none = len(seq)
+    # Position of visible nodes, lo of hidden ones, so children need one lookup
+    reach: dict[int, int] = {}
+    lo: dict[int, int] = {}
+    get = outgoing.get
+    empty: list[int] = []
+    for node in post:
+        node_lo = none
+        for child in get(node, empty):
+            child_lo = reach[child]
+            if child_lo < node_lo:
+                node_lo = child_lo
+        lo[node] = node_lo
+        reach[node] = pos.get(node, node_lo)
+    up: dict[int, int] = {}
+    for node in reversed(post):
+        node_up = pos.get(node)
+        if node_up is None:
+            node_up = up.get(node, 0)
+        for child in get(node, empty):
+            if up.get(child, -1) < node_up:
+                up[child] = node_up
+    return seq, lo, up, hidden
+
+
+def gaps(seq: list[int], lo: dict[int, int]) -> list[int]:
+    # Positions t where seq[t + 1] is not reachable from seq[t], the visible nodes form a
+    # chain if there are none
+    return [t for t in range(len(seq) - 1) if lo[seq[t]] != t + 1]
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import os
+import struct
+from typing import Iterable, Optional
+
+import pygit2  # type: ignore
+from attr import dataclass
+
+from .change import Change, FileNodes, FileRepr, State, get_diff
+from .store import Store, path_key
+
+
+@dataclass(slots=True, frozen=True)
+class Replay(object):
+    state: State
+    # (index of the first change of the commit in history, commit id)
+    commits: list[tuple[int, str]]
+    # uid -> line including its line ending
+    content: dict[int, bytes]
+    # Id of the last replayed commit (rev), replays continue from it
+    head: Optional[str] = None
+
+
+def _blob(commit: pygit2.Commit, path: str) -> Optional[pygit2.Blob]:
+    try:
+        return commit.tree[path]
+    except KeyError:
+        return None
+
+
+def _first_parents(
+    repo: pygit2.Repository, head: pygit2.Commit, since: Optional[str] = None
+) -> Optional[Iterable[pygit2.Commit]]:
+    # The first-parent chain of head, oldest first. With since only the commits after
+    # since, None if since is not on the chain.
+    walker = repo.walk(head.id, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_REVERSE)
+    walker.simplify_first_parent()
+    if since is None:
+        return walker
+    walker.hide(since)
+    commits = list(walker)
+    if commits:
+        parents = commits[0].parent_ids
+        if not parents or str(parents[0]) != since:
+            return None
+    elif str(head.id) != since:
+        return None
+    return commits
+
+
+def _versions(
+    commits: Iterable[pygit2.Commit], path: str, last: Optional[pygit2.Oid] = None
+) -> Iterable[tuple[str, bytes]]:
+    for commit in commits:
+        blob = _blob(commit, path)
+        oid = blob.id if blob is not None else None
+        if oid == last:
+            continue
+        last = oid
+        yield str(commit.id), blob.data if blob is not None else b""
+
+
+def file_history(
+    repo: pygit2.Repository, path: str, rev: str = "HEAD"
+) -> Iterable[tuple[str, bytes]]:
+    # Yields (commit id, data) for every first-parent commit that changed path, oldest
+    # first. A deleted file is reported as empty.
+    head = repo.revparse_single(rev).peel(pygit2.Commit)
+    return _versions(_first_parents(repo, head), path)
+
+
+def replay(
+    repo: pygit2.Repository,
+    path: str,
+    rev: str = "HEAD",
+    since: Optional[Replay] = None,
+) -> Replay:
+    # Text lines are matched to the lines of the previous version, unmatched lines get
+    # new uids. The uid lists are then diffed into changes. since is a replay of an
+    # earlier revision: if its head is a first-parent ancestor of rev only the commits
+    # after it are replayed, otherwise the whole history.
+    head = repo.revparse_single(rev).peel(pygit2.Commit)
+    chain = None
+    if since is not None and since.head is not None and since.head in repo:
+        chain = _first_parents(repo, head, since.head)
+    if since is None or chain is None:
+        state = State.from_file(FileRepr([]))
+        commits: list[tuple[int, str]] = []
+        content: dict[int, bytes] = {}
+        node_list: list[int] = []
+        last = None
+        chain = _first_parents(repo, head)
+    else:
+        state = since.state
+        commits = list(since.commits)
+        content = dict(since.content)
+        node_list = list(state.to_file().node_list)
+        blob = _blob(repo[since.head], path)
+        last = blob.id if blob is not None else None
+    lines = [content[x] for x in node_list]
+    max_uid = max(state.max_node, FileNodes.content - 1)
+    for commit, data in _versions(chain, path, last):
+        new_lines = data.splitlines(keepends=True)
+        new_node_list: list[int] = []
+        for tag, a_left, a_right, b_left, b_right in get_diff(lines, new_lines):
+            if tag == "equal":
+                new_node_list.extend(node_list[a_left:a_right])
+            elif tag in ("insert", "replace"):
+                for line in new_lines[b_left:b_right]:
+                    max_uid += 1
+                    new_node_list.append(max_uid)
+                    content[max_uid] = line
+        commits.append((len(state.history), commit))
+        for change in Change.from_diff(FileRepr(node_list), FileRepr(new_node_list)):
+            state = change.apply(state)
+        lines = new_lines
+        node_list = new_node_list
+    return Replay(state, commits, content, str(head.id))
+
+
+# Replays are persisted in a Store: the State under the path with the head commit as
+# oid and the commit boundaries in a file per path (head commit, then (index, commit)
+# entries). The content of the lines is read from the blob at the head commit.
+_commit_entry = struct.Struct("=Q20s")
+
+commits_name = "commits"
+
+
+def _commits_path(store: Store, path: str) -> str:
+    return os.path.join(store.directory, commits_name, path_key(path).hex())
+
+
+def load_replay(repo: pygit2.Repository, store: Store, path: str) -> Optional[Replay]:
+    # None if nothing usable is stored for path
+    head = store.oid(path)
+    if head is None or head.hex() not in repo:
+        return None
+    try:
+        with open(_commits_path(store, path), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if data[:20] != head or (len(data) - 20) % _commit_entry.size:
+        return None
+    commits = [(x, oid.hex()) for x, oid in _commit_entry.iter_unpack(data[20:])]
+    state = store.get(path)
+    assert state is not None
+    node_list = state.to_file().node_list
+    blob = _blob(repo[head.hex()], path)
+    lines = blob.data.splitlines(keepends=True) if blob is not None else []
+    if len(lines) != len(node_list):
+        return None
+    return Replay(state, commits, dict(zip(node_list, lines)), head.hex())
+
+
+def save_replay(store: Store, path: str, result: Replay):
+    assert result.head is not None
+    head = bytes.fromhex(result.head)
+    commits_path = _commits_path(store, path)
+    os.makedirs(os.path.dirname(commits_path), exist_ok=True)
+    tmp_path = commits_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(head)
+        for index, commit in result.commits:
+            f.write(_commit_entry.pack(index, bytes.fromhex(commit)))
+    os.replace(tmp_path, commits_path)
+    store.write([(path, head, result.state)])
+
+
+def cached_replay(
+    repo: pygit2.Repository, store: Store, path: str, rev: str = "HEAD"
+) -> Replay:
+    # replay continued from the replay of path in store, which is updated if rev moved
+    since = load_replay(repo, store, path)
+    result = replay(repo, path, rev, since)
+    if since is None or result.head != since.head:
+        save_replay(store, path, result)
+    return result
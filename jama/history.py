@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+from array import array
+from typing import Any, Iterable, Union
+
+from pyrsistent import pvector
+
+from .change import Change, Delete, Insert, Move, Revert
+from .codec import _delete, _insert, _move, _revert
+
+# Struct-of-arrays history, a drop in for the pvector in State.history. Every change is
+# a row of kind, first, second and start, the lines of Inserts and Moves are
+# runs in one lines column. Changes are materialized when they are accessed.
+#
+# Histories share their columns like slices: appending to the newest history appends
+# to the columns in place, appending to an older one copies the columns first. So a
+# linear history is appended in amortized O(1) and older States stay valid. Not thread
+# safe. The kinds are the ones of the codec.
+
+
+class _Columns(object):
+    __slots__ = ("kind", "first", "second", "start", "lines", "targets")
+
+    def __init__(self):
+        self.kind = array("b")
+        # predecessor, line or index in targets
+        self.first = array("q")
+        self.second = array("q")
+        # The run of a row in lines ends where the run of the next row starts
+        self.start = array("q")
+        self.lines = array("q")
+        # Reverts are rare, their targets are kept as objects
+        self.targets: list[Any] = []
+
+    def copy(self, length: int, lines: int, targets: int) -> _Columns:
+        columns = _Columns()
+        columns.kind = self.kind[:length]
+        columns.first = self.first[:length]
+        columns.second = self.second[:length]
+        columns.start = self.start[:length]
+        columns.lines = self.lines[:lines]
+        columns.targets = self.targets[:targets]
+        return columns
+
+    def _row(self, kind: int, first: int, second: int):
+        self.kind.append(kind)
+        self.first.append(first)
+        self.second.append(second)
+        self.start.append(len(self.lines))
+
+    def add(self, change: Change):
+        if isinstance(change, (Insert, Move)):
+            kind = _insert if isinstance(change, Insert) else _move
+            self._row(kind, change.predecessor, change.successor)
+            self.lines.extend(change.lines)
+        elif isinstance(change, Delete):
+            self._row(_delete, change.line, 0)
+        elif isinstance(change, Revert):
+            self._row(_revert, len(self.targets), 0)
+            self.targets.append(change.changes)
+        else:
+            raise TypeError("cannot store {0!r}".format(change))
+
+    def get(self, index: int, lines_end: int) -> Change:
+        kind = self.kind[index]
+        if kind == _delete:
+            return Delete.unchecked(self.first[index])
+        if kind == _revert:
+            return Revert.unchecked(self.targets[self.first[index]])
+        end = lines_end
+        if index + 1 < len(self.start):
+            end = self.start[index + 1]
+        lines = pvector(self.lines[self.start[index] : end])
+        cls = Insert if kind == _insert else Move
+        return cls.unchecked(self.first[index], lines, self.second[index])
+
+
+class ColumnarHistory(object):
+    __slots__ = ("_columns", "_length", "_lines", "_targets")
+
+    def __init__(self, changes: Iterable[Change] = ()):
+        columns = _Columns()
+        for change in changes:
+            columns.add(change)
+        self._set(columns)
+
+    def _set(self, columns: _Columns):
+        self._columns = columns
+        self._length = len(columns.kind)
+        self._lines = len(columns.lines)
+        self._targets = len(columns.targets)
+
+    def append(self, change: Change) -> ColumnarHistory:
+        columns = self._columns
+        if len(columns.kind) != self._length:
+            columns = columns.copy(self._length, self._lines, self._targets)
+        columns.add(change)
+        history = ColumnarHistory.__new__(ColumnarHistory)
+        history._set(columns)
+        return history
+
+    def extend(self, changes: Iterable[Change]) -> ColumnarHistory:
+        history = self
+        for change in changes:
+            history = history.append(change)
+        return history
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[x] for x in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("history index out of range")
+        return self._columns.get(index, self._lines)
+
+    def __iter__(self) -> Iterable[Change]:
+        get = self._columns.get
+        lines = self._lines
+        for index in range(self._length):
+            yield get(index, lines)
+
+    def __eq__(self, other) -> bool:
+        try:
+            if len(other) != self._length:
+                return False
+        except TypeError:
+            return NotImplemented
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return "ColumnarHistory({0!r})".format(list(self))
+
+    # Copies of the columns for bulk scans without materializing changes. Views would
+    # block appending to the shared columns.
+    def kinds(self) -> array:
+        return self._columns.kind[: self._length]
+
+    def lines(self) -> array:
+        return self._columns.lines[: self._lines]
+
+
+class CountingHistory(object):
+    # History of throwaway States, like the ones of a merge: only the number of changes
+    # is kept, the State keeps the fingerprint of the chain. Without changes there is no
+    # provenance, so States don't index creators and hiders and can't revert.
+    __slots__ = ("_length",)
+
+    keeps_changes = False
+
+    def __init__(self, length: int = 0):
+        self._length = length
+
+    def append(self, change: Change) -> CountingHistory:
+        return CountingHistory(self._length + 1)
+
+    def extend(self, changes: Iterable[Change]) -> CountingHistory:
+        return self.add(sum(1 for _ in changes))
+
+    def add(self, count: int) -> CountingHistory:
+        return CountingHistory(self._length + count)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        raise IndexError("history is not kept")
+
+    def __iter__(self) -> Iterable[Change]:
+        if self._length:
+            raise IndexError("history is not kept")
+        return iter(())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CountingHistory):
+            return NotImplemented
+        return self._length == other._length
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return "CountingHistory({0})".format(self._length)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import sys
+from typing import Any, Iterable
+
+import attr
+from attr import dataclass
+from pyrsistent import PVector
+
+from .change import FileNodes, State
+from .history import ColumnarHistory, CountingHistory
+
+# Estimated cost of one slot in the trie of a pvector. sys.getsizeof only reports the
+# header of the C implementation, the trie nodes are arrays of pointers.
+PVECTOR_SLOT = 8
+
+_core_fields = frozenset(("nodes", "edges", "max_node", "history"))
+
+# Bytes per node, edge, change, provenance entry (inserted or deleted line in
+# creators/hiders) and tombstone of a State, measured with memory_report on random
+# edits. The cost of a change depends on how the history stores it.
+NODE_BYTES = PVECTOR_SLOT
+EDGE_BYTES = 210
+CHANGE_BYTES = 92
+COLUMNAR_CHANGE_BYTES = 32
+INDEX_BYTES = 315
+TOMBSTONE_BYTES = 120
+
+
+@dataclass(slots=True, frozen=True)
+class MemoryReport(object):
+    nodes: int
+    edges: int
+    history: int
+    caches: int
+    lines: int
+    tombstones: int
+
+    @property
+    def total(self) -> int:
+        return self.nodes + self.edges + self.history + self.caches
+
+    @property
+    def tombstone_ratio(self) -> float:
+        all_lines = self.lines + self.tombstones
+        if not all_lines:
+            return 0.0
+        return self.tombstones / all_lines
+
+    @property
+    def bytes_per_line(self) -> float:
+        if not self.lines:
+            return float(self.total)
+        return self.total / self.lines
+
+
+def _children(obj: Any) -> Iterable[Any]:
+    if isinstance(obj, dict):
+        yield from obj.keys()
+        yield from obj.values()
+    elif isinstance(obj, (PVector, tuple, list, set, frozenset)):
+        yield from obj
+    else:
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if slot not in ("__weakref__", "__dict__") and hasattr(obj, slot):
+                    yield getattr(obj, slot)
+        if hasattr(obj, "__dict__"):
+            yield obj.__dict__
+
+
+def deep_sizeof(obj: Any, seen: set[int]) -> int:
+    # Objects shared between fields (or between states) are only counted once per seen
+    # set.
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, PVector):
+            size += len(obj) * PVECTOR_SLOT
+        stack.extend(_children(obj))
+    return size
+
+
+def memory_report(state: State) -> MemoryReport:
+    seen: set[int] = set()
+    nodes = deep_sizeof(state.nodes, seen)
+    edges = deep_sizeof(state.edges, seen)
+    history = deep_sizeof(state.history, seen)
+    caches = 0
+    for field in attr.fields(type(state)):
+        if field.name not in _core_fields:
+            caches += deep_sizeof(getattr(state, field.name), seen)
+
+    # Holes in the uid space are not tombstones, only nodes reachable through edges
+    # are.
+    graph_nodes = set()
+    for from_, to in state.edges:
+        graph_nodes.add(from_)
+        graph_nodes.add(to)
+    content = FileNodes.content
+    lines = 0
+    tombstones = 0
+    for node in graph_nodes:
+        if node < content:
+            continue
+        if state.nodes[node]:
+            lines += 1
+        else:
+            tombstones += 1
+    return MemoryReport(nodes, edges, history, caches, lines, tombstones)
+
+
+def estimate_size(state: State) -> int:
+    # O(1) estimate of memory_report(state).total, which walks every object
+    size = NODE_BYTES * len(state.nodes) + EDGE_BYTES * len(state.edges)
+    history = state.history
+    if isinstance(history, ColumnarHistory):
+        size += COLUMNAR_CHANGE_BYTES * len(history)
+    elif not isinstance(history, CountingHistory):
+        size += CHANGE_BYTES * len(history)
+    size += INDEX_BYTES * (len(state.creators) + len(state.hiders))
+    return size + TOMBSTONE_BYTES * len(state.tombstones)
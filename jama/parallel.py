@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import os
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Mapping, Sequence, Union
+
+from attr import dataclass
+
+from .change import (
+    Conflict,
+    Edge,
+    FileRepr,
+    Linearization,
+    State,
+    _IntFileNodes,
+    linearize,
+)
+
+# Parallel projection of many files and of single large files. A large file is split
+# at anchors: visible nodes every path from start to end passes through. The reverse
+# postorder of the graph is the concatenation of the reverse postorders of the segments
+# between anchors and no conflict can span an anchor, so the segments can be linearized
+# independently and stitched. Finding the anchors is one pass over the edges, the
+# linearization of the segments is parallel.
+
+
+@dataclass(slots=True, frozen=True)
+class Segment(object):
+    # The part of a graph between two anchors, start and end are not part of the
+    # projected file
+    nodes: Mapping[int, bool]
+    edges: list[Edge]
+    start: int
+    end: int
+
+
+def cost(state: State) -> int:
+    return len(state.nodes) * max(1, len(state.history))
+
+
+def run_by_cost(
+    executor: Executor, func: Callable, items: Sequence[Any], costs: Sequence[int]
+) -> list[Any]:
+    # The most expensive items are submitted first, so the cheap ones fill the gaps at
+    # the end. Results are in the order of items.
+    order = sorted(range(len(items)), key=lambda i: (-costs[i], i))
+    futures = {i: executor.submit(func, items[i]) for i in order}
+    return [futures[i].result() for i in range(len(items))]
+
+
+def _topological(edges: Sequence[Edge], start: int):
+    # Yields (node, True if node is a cut vertex) in topological order. If all edges
+    # leaving the nodes placed so far point to the next node, it is a cut vertex.
+    outgoing: dict[int, list[int]] = {}
+    indegree: dict[int, int] = {}
+    for from_, to in edges:
+        outgoing.setdefault(from_, []).append(to)
+        indegree[to] = indegree.get(to, 0) + 1
+    remaining = dict(indegree)
+    open_ = 0
+    ready = deque([start])
+    while ready:
+        node = ready.popleft()
+        node_in = indegree.get(node, 0)
+        yield node, open_ == node_in
+        open_ -= node_in
+        for child in outgoing.get(node, ()):
+            open_ += 1
+            remaining[child] -= 1
+            if not remaining[child]:
+                ready.append(child)
+
+
+def cut_vertices(edges: Sequence[Edge], start: int = _IntFileNodes.start) -> list[int]:
+    return [node for node, cut in _topological(edges, start) if cut]
+
+
+def partition(state: State, parts: int) -> list[Segment]:
+    # Splits state into at most parts segments of about the same number of nodes
+    start = _IntFileNodes.start
+    end = _IntFileNodes.end
+    nodes = state.nodes
+    edges = list(state.edges)
+    order = []
+    anchors = []
+    for node, cut in _topological(edges, start):
+        order.append(node)
+        if cut and nodes[node] and node not in (start, end):
+            anchors.append(len(order) - 1)
+    size = max(1, len(order) // max(1, parts))
+    chosen = []
+    last = 0
+    for at in anchors:
+        if at - last >= size and len(order) - at >= size:
+            chosen.append(at)
+            last = at
+    segment_of: dict[int, int] = {}
+    bounds = [0] + chosen + [len(order)]
+    for index in range(len(bounds) - 1):
+        for node in order[bounds[index] : bounds[index + 1]]:
+            segment_of[node] = index
+    segment_edges: list[list[Edge]] = [[] for _ in range(len(bounds) - 1)]
+    for edge in edges:
+        segment_edges[segment_of[edge[0]]].append(edge)
+    anchor_nodes = [start] + [order[x] for x in chosen] + [end]
+    segments = []
+    for index, seg_edges in enumerate(segment_edges):
+        seg_nodes = {to: nodes[to] for _, to in seg_edges}
+        segments.append(
+            Segment(seg_nodes, seg_edges, anchor_nodes[index], anchor_nodes[index + 1])
+        )
+    return segments
+
+
+def project(item: Union[State, Segment]) -> Linearization:
+    if isinstance(item, State):
+        return item.linearize()
+    return linearize(item.nodes, item.edges, item.start, item.end)
+
+
+def stitch(segments: Sequence[Any], linears: Sequence[Linearization]) -> Linearization:
+    node_list: list[int] = []
+    conflicts = []
+    for segment, linear in zip(segments, linears):
+        if segment.start != _IntFileNodes.start:
+            node_list.append(segment.start)
+        offset = len(node_list)
+        node_list.extend(linear.file_.node_list)
+        for conflict in linear.conflicts:
+            conflicts.append(
+                Conflict(
+                    conflict.start + offset,
+                    conflict.end + offset,
+                    [(x + offset, y + offset) for x, y in conflict.sides],
+                    conflict.base,
+                )
+            )
+    return Linearization(FileRepr(node_list), conflicts)
+
+
+def linearize_files(
+    executor: Executor, states: Sequence[State], split: int = 1 << 16, parts: int = 0
+) -> list[Linearization]:
+    # Linearizes states in executor. States with more than split nodes are partitioned
+    # into parts segments (default: the number of cpus). The result is the same as
+    # state.linearize() for each state.
+    if not parts:
+        parts = os.cpu_count() or 1
+    items: list[Union[State, Segment]] = []
+    costs: list[int] = []
+    layout: list[tuple[int, int]] = []
+    for state in states:
+        first = len(items)
+        state_cost = cost(state)
+        if len(state.nodes) > split and parts > 1:
+            for segment in partition(state, parts):
+                items.append(segment)
+                costs.append(state_cost * len(segment.edges) // len(state.edges))
+        else:
+            items.append(state)
+            costs.append(state_cost)
+        layout.append((first, len(items)))
+    results = run_by_cost(executor, project, items, costs)
+    linears = []
+    for first, last in layout:
+        if last - first == 1:
+            linears.append(results[first])
+        else:
+            linears.append(stitch(items[first:last], results[first:last]))
+    return linears
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+from . import treap
+from .treap import size as _size
+
+# Persistent piece table: a treap of pieces ordered by position. A piece is a run of
+# uids start, start + step, ... as allocated by one insert, so the table grows with the
+# number of edits, not with the number of lines. Insert and delete split and merge the
+# treap in O(log pieces), all versions share unchanged subtrees. Priorities are the
+# mixed start of the piece.
+
+
+class _Piece(treap.Node):
+    __slots__ = ("start", "step", "length")
+
+    def __init__(self, start, step, length, priority, left, right):
+        self.start = start
+        self.step = step
+        self.length = length
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = length + _size(left) + _size(right)
+
+    def with_children(self, left, right) -> _Piece:
+        return _Piece(self.start, self.step, self.length, self.priority, left, right)
+
+    def cut(self, offset: int) -> tuple[_Piece, _Piece]:
+        start = self.start
+        step = self.step
+        head = _Piece(start, step, offset, self.priority, self.left, None)
+        return head, _leaf(start + offset * step, step, self.length - offset)
+
+
+def _leaf(start: int, step: int, length: int) -> _Piece:
+    return _Piece(start, step, length, treap.mix(start), None, None)
+
+
+def _make(run: tuple[int, int, int], priority: int, left, right) -> _Piece:
+    return _Piece(*run, priority, left, right)
+
+
+def _runs(node_list: Iterable[int]) -> Iterable[tuple[int, int, int]]:
+    start = None
+    step = 0
+    length = 0
+    for uid in node_list:
+        if start is None:
+            start, step, length = uid, 1, 1
+        elif length == 1 and uid > start:
+            step = uid - start
+            length = 2
+        elif uid == start + length * step:
+            length += 1
+        else:
+            yield start, step, length
+            start, step, length = uid, 1, 1
+    if start is not None:
+        yield start, step, length
+
+
+class PieceTable(object):
+    __slots__ = ("root",)
+
+    def __init__(self, root: Optional[_Piece] = None):
+        self.root = root
+
+    @classmethod
+    def from_node_list(cls, node_list: Iterable[int]) -> PieceTable:
+        runs = ((treap.mix(run[0]), run) for run in _runs(node_list))
+        return cls(treap.build(runs, _make))
+
+    def __len__(self) -> int:
+        return _size(self.root)
+
+    @property
+    def pieces(self) -> int:
+        count = 0
+        stack = [self.root]
+        while stack:
+            piece = stack.pop()
+            if piece is not None:
+                count += 1
+                stack.append(piece.left)
+                stack.append(piece.right)
+        return count
+
+    def insert(self, offset: int, start: int, step: int, length: int) -> PieceTable:
+        if offset < 0 or offset > len(self):
+            raise IndexError()
+        if length <= 0:
+            return self
+        left, right = treap.split(self.root, offset)
+        leaf = _leaf(start, step, length)
+        return PieceTable(treap.merge(treap.merge(left, leaf), right))
+
+    def delete(self, offset: int, size: int) -> PieceTable:
+        offset = max(0, offset)
+        if size <= 0 or offset >= len(self):
+            return self
+        left, rest = treap.split(self.root, offset)
+        _, right = treap.split(rest, size)
+        return PieceTable(treap.merge(left, right))
+
+    def __iter__(self) -> Iterable[int]:
+        for piece in treap.inorder(self.root):
+            start = piece.start
+            yield from range(start, start + piece.length * piece.step, piece.step)
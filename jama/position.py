@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional, Sequence
+
+from pyrsistent import pmap
+from pyrsistent.typing import PMap
+
+from . import treap
+from .treap import size as _size
+
+# Persistent order statistic index of the visible lines: a treap ordered by position,
+# every line also has an order key, increasing with the position. Subtree sizes answer
+# the line at a position, the keys (uid -> key) answer the position of a line, both in
+# O(log n). Ranges are read in O(log n + m).
+#
+# New lines get keys spaced evenly in the gap between their neighbours. If the gap is
+# too small the keys of a window around the insert are spaced again, the window
+# doubles until its key range is large enough, so relabeling is amortized. Priorities are
+# the mixed uid.
+
+_spacing = 1 << 32
+
+
+class _Line(treap.Node):
+    __slots__ = ("key", "uid")
+
+    def __init__(self, key, uid, priority, left, right):
+        self.key = key
+        self.uid = uid
+        self.priority = priority
+        self.left = left
+        self.right = right
+        self.size = 1 + _size(left) + _size(right)
+
+    def with_children(self, left, right) -> _Line:
+        return _Line(self.key, self.uid, self.priority, left, right)
+
+
+def _make(line: tuple[int, int], priority: int, left, right) -> _Line:
+    return _Line(*line, priority, left, right)
+
+
+def _build(keys: Sequence[int], uids: Sequence[int]) -> Optional[_Line]:
+    lines = ((treap.mix(uid), (key, uid)) for key, uid in zip(keys, uids))
+    return treap.build(lines, _make)
+
+
+def _select(line: Optional[_Line], offset: int) -> _Line:
+    while line is not None:
+        left_size = _size(line.left)
+        if offset < left_size:
+            line = line.left
+        elif offset == left_size:
+            return line
+        else:
+            offset -= left_size + 1
+            line = line.right
+    raise IndexError("position out of range")
+
+
+def _spaced(low: int, high: Optional[int], count: int) -> Optional[list[int]]:
+    # count keys strictly between low and high, None if they don't fit
+    if high is None:
+        return [low + _spacing * (x + 1) for x in range(count)]
+    step = (high - low) // (count + 1)
+    if not step:
+        return None
+    return [low + step * (x + 1) for x in range(count)]
+
+
+class PositionIndex(object):
+    __slots__ = ("root", "keys")
+
+    def __init__(self, root: Optional[_Line] = None, keys: PMap[int, int] = pmap()):
+        self.root = root
+        self.keys = keys
+
+    @classmethod
+    def from_node_list(cls, node_list: Sequence[int]) -> PositionIndex:
+        keys = [_spacing * (x + 1) for x in range(len(node_list))]
+        return cls(_build(keys, node_list), pmap(dict(zip(node_list, keys))))
+
+    def __len__(self) -> int:
+        return _size(self.root)
+
+    def __getitem__(self, offset: int) -> int:
+        if offset < 0:
+            offset += len(self)
+        if offset < 0:
+            raise IndexError("position out of range")
+        return _select(self.root, offset).uid
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self.keys
+
+    def __iter__(self) -> Iterable[int]:
+        for line in treap.inorder(self.root):
+            yield line.uid
+
+    def index(self, uid: int) -> int:
+        # Position of a visible line, like list.index
+        key = self.keys.get(uid)
+        if key is None:
+            raise ValueError("{0} is not a visible line".format(uid))
+        offset = 0
+        line = self.root
+        while line.key != key:
+            if key < line.key:
+                line = line.left
+            else:
+                offset += _size(line.left) + 1
+                line = line.right
+        return offset + _size(line.left)
+
+    def lines(self, offset: int, count: int) -> list[int]:
+        # The lines from offset to offset + count, clipped to the file
+        offset = max(0, offset)
+        result: list[int] = []
+        if count <= 0 or offset >= len(self):
+            return result
+        stack = []
+        line = self.root
+        while line is not None:
+            left_size = _size(line.left)
+            if offset < left_size:
+                stack.append(line)
+                line = line.left
+            elif offset == left_size:
+                break
+            else:
+                offset -= left_size + 1
+                line = line.right
+        while line is not None and len(result) < count:
+            result.append(line.uid)
+            line = line.right
+            while line is not None:
+                stack.append(line)
+                line = line.left
+            line = stack.pop() if stack else None
+        return result
+
+    def _key(self, offset: int) -> Optional[int]:
+        if 0 <= offset < len(self):
+            return _select(self.root, offset).key
+        return None
+
+    def insert(self, offset: int, uids: Sequence[int]) -> PositionIndex:
+        size = len(self)
+        if offset < 0 or offset > size:
+            raise IndexError("position out of range")
+        if not uids:
+            return self
+        width = 0
+        while True:
+            start = max(0, offset - width)
+            end = min(size, offset + width)
+            low = self._key(start - 1) if start else 0
+            high = self._key(end)
+            keys = _spaced(low, high, end - start + len(uids))
+            if keys is not None:
+                break
+            width = width * 2 or 1
+        left, rest = treap.split(self.root, start)
+        window, right = treap.split(rest, end - start)
+        at = offset - start
+        window_uids = [line.uid for line in treap.inorder(window)]
+        window_uids[at:at] = uids
+        key_map = self.keys.evolver()
+        for uid, key in zip(window_uids, keys):
+            key_map[uid] = key
+        root = treap.merge(treap.merge(left, _build(keys, window_uids)), right)
+        return PositionIndex(root, key_map.persistent())
+
+    def delete(self, offset: int, count: int) -> PositionIndex:
+        offset = max(0, offset)
+        if count <= 0 or offset >= len(self):
+            return self
+        left, rest = treap.split(self.root, offset)
+        removed, right = treap.split(rest, count)
+        key_map = self.keys.evolver()
+        for line in treap.inorder(removed):
+            del key_map[line.uid]
+        return PositionIndex(treap.merge(left, right), key_map.persistent())
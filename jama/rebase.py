@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+from .change import (
+    Change,
+    ConflictError,
+    Delete,
+    FileRepr,
+    Insert,
+    Linearization,
+    Move,
+    State,
+)
+
+# Applies a stack of commits (batches of changes) to a new base in one pass. The states
+# after each commit share structure, projections are only computed when asked for.
+#
+# Finding the first conflicting commit does not need a projection per commit: on a
+# conflict free state a Delete can't create a conflict, hiding a line keeps the chain of
+# visible lines connected. An Insert continues the chain if it replaces the only edge
+# leaving its predecessor and the only edge entering its successor and one of them is
+# visible. Only commits with other Inserts, Moves or a Revert, that might show a line
+# again, have to be projected.
+
+
+class Stack(object):
+    __slots__ = ("base", "states", "_candidates", "_linears", "_first")
+
+    def __init__(self, base: State, states: list[State], candidates: list[bool]):
+        self.base = base
+        self.states = states
+        self._candidates = candidates
+        self._linears: dict[int, Linearization] = {}
+        self._first: Optional[int] = -1
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __getitem__(self, index: int) -> State:
+        return self.states[index]
+
+    @property
+    def head(self) -> State:
+        if self.states:
+            return self.states[-1]
+        return self.base
+
+    def linearize(self, index: int) -> Linearization:
+        if index < 0:
+            index += len(self.states)
+        linear = self._linears.get(index)
+        if linear is None:
+            linear = self.states[index].linearize()
+            self._linears[index] = linear
+        return linear
+
+    def to_file(self, index: int) -> FileRepr:
+        # Like State.to_file, from the cached linearization
+        linear = self.linearize(index)
+        if linear.conflicts:
+            raise ConflictError(linear)
+        return linear.file_
+
+    def first_conflict(self) -> Optional[int]:
+        # Index of the first commit with conflicts, None if there are none
+        if self._first == -1:
+            self._first = self._find_first()
+        return self._first
+
+    def _find_first(self) -> Optional[int]:
+        check_all = bool(self.base.linearize().conflicts)
+        for index, candidate in enumerate(self._candidates):
+            if (check_all or candidate) and self.linearize(index).conflicts:
+                return index
+        return None
+
+
+class _Degrees(object):
+    __slots__ = ("outgoing", "incoming")
+
+    def __init__(self, state: State):
+        outgoing: dict[int, int] = {}
+        incoming: dict[int, int] = {}
+        for from_, to in state.edges:
+            outgoing[from_] = outgoing.get(from_, 0) + 1
+            incoming[to] = incoming.get(to, 0) + 1
+        self.outgoing = outgoing
+        self.incoming = incoming
+
+    def forks(self, state: State, change: Change) -> bool:
+        # Has to be called before change is applied to state
+        if isinstance(change, Delete):
+            return False
+        if not isinstance(change, Insert):
+            return True
+        pre = change.predecessor
+        suc = change.successor
+        for line in change.lines:
+            self.outgoing[line] = 1
+            self.incoming[line] = 1
+        if (pre, suc) not in state.edges:
+            self.outgoing[pre] = self.outgoing.get(pre, 0) + 1
+            self.incoming[suc] = self.incoming.get(suc, 0) + 1
+            return True
+        if self.outgoing[pre] != 1 or self.incoming[suc] != 1:
+            return True
+        return not (state.nodes[pre] or state.nodes[suc])
+
+
+def transform_stack(base: State, batches: Iterable[Iterable[Change]]) -> Stack:
+    states = []
+    candidates = []
+    degrees = _Degrees(base)
+    state = base
+    for batch in batches:
+        candidate = False
+        for change in batch:
+            candidate = degrees.forks(state, change) or candidate
+            state = change.apply(state)
+            if isinstance(change, Move):
+                # Moves relink edges anywhere in the run, recount
+                degrees = _Degrees(state)
+        states.append(state)
+        candidates.append(candidate)
+    return Stack(base, states, candidates)
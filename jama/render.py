@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from typing import BinaryIO, Callable, Mapping, Optional, Sequence, Union
+
+from .change import Linearization, State, _keeps_changes
+
+Content = Union[Callable[[int], bytes], Mapping[int, bytes]]
+
+start_marker = b"<<<<<<<"
+base_marker = b"|||||||"
+side_marker = b"======="
+end_marker = b">>>>>>>"
+
+
+class _Writer(object):
+    # Buffers output and writes it to out in chunks
+    __slots__ = ("out", "buffer", "chunk_size", "last")
+
+    def __init__(self, out: BinaryIO, chunk_size: int):
+        self.out = out
+        self.buffer = bytearray()
+        self.chunk_size = chunk_size
+        self.last = b"\n"
+
+    def write(self, data: bytes):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def marker(self, marker: bytes, label: str = ""):
+        # Markers have to start on a new line, even if the content is not terminated
+        if (self.buffer[-1:] or self.last) != b"\n":
+            self.buffer += b"\n"
+        self.buffer += marker
+        if label:
+            self.buffer += b" " + label.encode("utf-8")
+        self.write(b"\n")
+
+    def flush(self):
+        if self.buffer:
+            self.out.write(self.buffer)
+            self.last = self.buffer[-1:]
+            self.buffer = bytearray()
+
+
+def _lines(writer: _Writer, content: Callable[[int], bytes], uids, start, end):
+    for i in range(start, end):
+        writer.write(content(uids[i]))
+
+
+def _merge_base(state: State, base: Sequence[int], since: int) -> list[int]:
+    # The lines of base that were created before history index since and hidden by
+    # changes from since on, so visible when the sides diverged
+    if not _keeps_changes(state.history):
+        raise ValueError("the merge base needs a State with history")
+    creators = state.creators
+    hiders = state.hiders
+    reverted = state.reverted
+    result = []
+    for uid in base:
+        created = creators.get(uid)
+        if created is not None and created >= since:
+            continue
+        hidden = [x for x in hiders.get(uid, ()) if x not in reverted]
+        if hidden and min(hidden) >= since:
+            result.append(uid)
+    return result
+
+
+def render(
+    source: Union[State, Linearization],
+    content: Content,
+    out: BinaryIO,
+    diff3: bool = False,
+    labels: Sequence[str] = (),
+    chunk_size: int = 1 << 16,
+    since: Optional[int] = None,
+) -> int:
+    # Streams the linearized file to out, conflicts are written with git style markers.
+    # content maps uids to lines (including their line ending). labels are the labels of
+    # the first and last side, or first side, base and last side. Returns the number of
+    # conflicts. The diff3 base are all hidden lines of the conflict, with since, the
+    # length of history when the sides diverged, only the lines of the merge base that
+    # the sides hid. since needs a State.
+    state = None
+    if isinstance(source, State):
+        state = source
+        source = source.linearize()
+    if since is not None and state is None:
+        raise ValueError("since needs a State")
+    if isinstance(content, Mapping):
+        content = content.__getitem__
+    labels = list(labels)
+    start_label = labels[0] if labels else ""
+    end_label = labels[-1] if len(labels) > 1 else ""
+    base_label = labels[1] if len(labels) > 2 else ""
+    node_list = source.file_.node_list
+    writer = _Writer(out, chunk_size)
+    pos = 0
+    for conflict in source.conflicts:
+        _lines(writer, content, node_list, pos, conflict.start)
+        sides = conflict.sides
+        writer.marker(start_marker, start_label)
+        _lines(writer, content, node_list, *sides[0])
+        if diff3:
+            writer.marker(base_marker, base_label)
+            base = conflict.base
+            if since is not None:
+                base = _merge_base(state, base, since)
+            _lines(writer, content, base, 0, len(base))
+        for side in sides[1:]:
+            writer.marker(side_marker)
+            _lines(writer, content, node_list, *side)
+        if len(sides) == 1:
+            writer.marker(side_marker)
+        writer.marker(end_marker, end_label)
+        pos = conflict.end
+    _lines(writer, content, node_list, pos, len(node_list))
+    writer.flush()
+    return len(source.conflicts)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Hashable, Optional
+
+from .change import Change, FileRepr, Linearization, State
+
+
+# The stages are module level functions, so they can be sent to a process pool
+def diff(a: FileRepr, b: FileRepr) -> list[Change]:
+    return list(Change.from_diff(a, b))
+
+
+def linearize(state: State) -> Linearization:
+    return state.linearize()
+
+
+def to_file(state: State) -> FileRepr:
+    return state.to_file()
+
+
+def merge(base: FileRepr, *sides: FileRepr) -> Linearization:
+    # The sides have to be derived from base with distinct uids for new lines, see
+    # ReplicaFileReprEdit.
+    state = State.from_file(base)
+    for side in sides:
+        for change in Change.from_diff(base, side):
+            state = change.apply(state)
+    return state.linearize()
+
+
+class _Job(object):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class MergeService(object):
+    # Runs the CPU heavy stages in executor (None is the default executor of the loop),
+    # at most concurrency at a time. Concurrent requests with equal arguments share one
+    # computation. A request that is cancelled or runs over its deadline only cancels
+    # the computation if no other request waits for it, a computation that already
+    # runs in the executor can't be interrupted though.
+    __slots__ = ("executor", "timeout", "_semaphore", "_jobs")
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        concurrency: int = 8,
+        timeout: Optional[float] = None,
+    ):
+        self.executor = executor
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs: dict[Hashable, _Job] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._jobs)
+
+    async def _compute(self, func: Callable, args: tuple) -> Any:
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    def _done(self, key: Hashable, job: _Job):
+        if self._jobs.get(key) is job:
+            del self._jobs[key]
+
+    async def run(
+        self, func: Callable, *args: Any, timeout: Optional[float] = None
+    ) -> Any:
+        key = (func, args)
+        job = self._jobs.get(key)
+        if job is None:
+            job = _Job(asyncio.ensure_future(self._compute(func, args)))
+            self._jobs[key] = job
+            job.task.add_done_callback(lambda _: self._done(key, job))
+        if timeout is None:
+            timeout = self.timeout
+        job.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.task), timeout)
+        finally:
+            job.waiters -= 1
+            if not job.waiters and not job.task.done():
+                job.task.cancel()
+                self._done(key, job)
+
+    async def diff(
+        self, a: FileRepr, b: FileRepr, timeout: Optional[float] = None
+    ) -> list[Change]:
+        return await self.run(diff, a, b, timeout=timeout)
+
+    async def linearize(
+        self, state: State, timeout: Optional[float] = None
+    ) -> Linearization:
+        return await self.run(linearize, state, timeout=timeout)
+
+    async def to_file(self, state: State, timeout: Optional[float] = None) -> FileRepr:
+        return await self.run(to_file, state, timeout=timeout)
+
+    async def merge(
+        self, base: FileRepr, *sides: FileRepr, timeout: Optional[float] = None
+    ) -> Linearization:
+        return await self.run(merge, base, *sides, timeout=timeout)
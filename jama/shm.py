@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import mmap
+import struct
+from array import array
+from multiprocessing import shared_memory
+from typing import Iterable, Optional
+
+from pyrsistent import pvector
+
+from .change import (
+    ConflictError,
+    Edge,
+    FileRepr,
+    Linearization,
+    State,
+    _keeps_changes,
+    _pset,
+    linearize,
+)
+from .codec import DecodeError, decode_changes, encode_changes
+from .history import CountingHistory
+
+# Flat export of a State: header, one byte per node, the sorted edges as native int64
+# pairs and the history in the codec format. A SharedState is a read-only view of an
+# export in shared memory or an mmap'd file, nothing is copied or unpickled when
+# attaching. Projections read the nodes and edges directly from the buffer. States with
+# a CountingHistory export an empty change log and the number of changes.
+
+_magic = b"JAMA"
+_version = 2
+_header = struct.Struct("=4sIqQQQQQQ")
+
+
+def _layout(state: State) -> tuple[bytes, bytes, bytes, bytes]:
+    nodes = bytes(bytearray(state.nodes))
+    edges = array("q")
+    for from_, to in sorted(state.edges):
+        edges.append(from_)
+        edges.append(to)
+    history = b""
+    if _keeps_changes(state.history):
+        history = encode_changes(state.history)
+    header = _header.pack(
+        _magic,
+        _version,
+        state.max_node,
+        len(nodes),
+        len(edges) // 2,
+        len(history),
+        len(state.history),
+        state.fingerprint,
+        state.history_fingerprint,
+    )
+    return header, nodes, edges.tobytes(), history
+
+
+def _write(buffer: memoryview, parts: Iterable[bytes]):
+    pos = 0
+    for part in parts:
+        buffer[pos : pos + len(part)] = part
+        pos += len(part)
+
+
+def export_shared(state: State, name: Optional[str] = None):
+    # The caller owns the returned SharedMemory and has to close() and unlink() it
+    parts = _layout(state)
+    size = sum(len(x) for x in parts)
+    shm = shared_memory.SharedMemory(name, create=True, size=max(1, size))
+    _write(shm.buf, parts)
+    return shm
+
+
+def export_file(state: State, path: str):
+    with open(path, "wb") as f:
+        for part in _layout(state):
+            f.write(part)
+
+
+class SharedState(object):
+    __slots__ = (
+        "max_node",
+        "changes",
+        "fingerprint",
+        "history_fingerprint",
+        "nodes",
+        "_edges",
+        "_history",
+        "_buffer",
+        "_views",
+        "_owner",
+    )
+
+    def __init__(self, buffer: memoryview, owner=None):
+        self._buffer = buffer
+        buffer = buffer.toreadonly()
+        if len(buffer) < _header.size:
+            raise DecodeError("truncated header")
+        (
+            magic,
+            version,
+            self.max_node,
+            nodes,
+            edges,
+            history,
+            self.changes,
+            self.fingerprint,
+            self.history_fingerprint,
+        ) = _header.unpack_from(buffer)
+        if magic != _magic or version != _version:
+            raise DecodeError("not a jama export")
+        pos = _header.size
+        if len(buffer) < pos + nodes + edges * 16 + history:
+            raise DecodeError("truncated export")
+        self.nodes = buffer[pos : pos + nodes]
+        pos += nodes
+        self._edges = buffer[pos : pos + edges * 16].cast("q")
+        pos += edges * 16
+        self._history = buffer[pos : pos + history]
+        self._views = (self.nodes, self._edges, self._history, buffer)
+        self._owner = owner
+
+    @classmethod
+    def attach(cls, name: str) -> SharedState:
+        shm = shared_memory.SharedMemory(name)
+        return cls(shm.buf, shm)
+
+    @classmethod
+    def open(cls, path: str) -> SharedState:
+        with open(path, "rb") as f:
+            map_ = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memoryview(map_), map_)
+
+    def edges(self) -> Iterable[Edge]:
+        edges = self._edges
+        for i in range(0, len(edges), 2):
+            yield edges[i], edges[i + 1]
+
+    def history(self) -> Iterable:
+        # Empty if the State only counted its changes
+        return decode_changes(self._history)
+
+    def linearize(self) -> Linearization:
+        return linearize(self.nodes, self.edges())
+
+    def to_file(self) -> FileRepr:
+        linear = self.linearize()
+        if linear.conflicts:
+            raise ConflictError(linear)
+        return linear.file_
+
+    def to_state(self) -> State:
+        nodes = pvector(bool(x) for x in self.nodes)
+        if self.changes and not self._history:
+            # The chain can't be computed without the changes
+            return State(
+                nodes,
+                _pset(self.edges()),
+                self.max_node,
+                CountingHistory(self.changes),
+                fingerprint=self.fingerprint,
+                history_fingerprint=self.history_fingerprint,
+            )
+        return State(nodes, _pset(self.edges()), self.max_node, pvector(self.history()))
+
+    def close(self):
+        # Views into the buffer have to be released before the buffer can be closed
+        for view in self._views + (self._buffer,):
+            view.release()
+        owner = self._owner
+        self._owner = None
+        if owner is not None:
+            owner.close()
+
+    def __enter__(self) -> SharedState:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
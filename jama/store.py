@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+from .change import State
+from .codec import DecodeError
+from .memory import estimate_size
+from .shm import SharedState, _layout
+
+# Repository store: a data file with the exports of the States (graph and change log,
+# see shm) and an index of fixed size entries (path key, blob oid, offset, size) sorted
+# by key. Both are mmap'd, so opening a store is O(1) and a lookup is a binary search
+# in the index. States are loaded on first access and kept in an LRU limited by the
+# estimated memory of the States.
+
+_magic = b"JAMI"
+_version = 1
+_header = struct.Struct("=4sIQ")
+_entry = struct.Struct("=16s20sQQ")
+
+index_name = "index"
+data_name = "data"
+
+
+def path_key(path: str) -> bytes:
+    return blake2b(path.encode("utf-8"), digest_size=16).digest()
+
+
+def _map(path: str) -> Optional[mmap.mmap]:
+    try:
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+
+
+class Store(object):
+    __slots__ = (
+        "directory",
+        "budget",
+        "hits",
+        "misses",
+        "_index",
+        "_data",
+        "_count",
+        "_cache",
+        "_used",
+    )
+
+    def __init__(self, directory: str, budget: int = 64 << 20):
+        self.directory = directory
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[bytes, tuple[State, int]] = OrderedDict()
+        self._used = 0
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self._index = _map(os.path.join(self.directory, index_name))
+        self._data = _map(os.path.join(self.directory, data_name))
+        self._count = 0
+        if self._index is not None:
+            magic, version, count = _header.unpack_from(self._index)
+            if magic != _magic or version != _version:
+                raise DecodeError("not a jama store index")
+            self._count = count
+
+    def close(self):
+        for map_ in (self._index, self._data):
+            if map_ is not None:
+                map_.close()
+        self._index = None
+        self._data = None
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _entry(self, position: int) -> tuple[bytes, bytes, int, int]:
+        return _entry.unpack_from(self._index, _header.size + position * _entry.size)
+
+    def _find(self, key: bytes) -> Optional[tuple[bytes, bytes, int, int]]:
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count:
+            entry = self._entry(low)
+            if entry[0] == key:
+                return entry
+        return None
+
+    def __contains__(self, path: str) -> bool:
+        return self._find(path_key(path)) is not None
+
+    def oid(self, path: str) -> Optional[bytes]:
+        entry = self._find(path_key(path))
+        if entry is None:
+            return None
+        return entry[1]
+
+    def _load(self, key: bytes, offset: int, size: int) -> State:
+        with memoryview(self._data) as data:
+            with SharedState(data[offset : offset + size]) as shared:
+                state = shared.to_state()
+        self.misses += 1
+        self._remember(key, state)
+        return state
+
+    def _remember(self, key: bytes, state: State):
+        cache = self._cache
+        size = estimate_size(state)
+        cache[key] = (state, size)
+        self._used += size
+        while self._used > self.budget and len(cache) > 1:
+            _, (_, evicted) = cache.popitem(last=False)
+            self._used -= evicted
+
+    def get(self, path: str, oid: Optional[bytes] = None) -> Optional[State]:
+        # None if path is unknown or stored for another blob than oid
+        key = path_key(path)
+        entry = self._find(key)
+        if entry is None or (oid is not None and entry[1] != oid):
+            return None
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+        return self._load(key, entry[2], entry[3])
+
+    def prefetch(self, paths: Iterable[str]):
+        # Loads the missing States in the order of the data file
+        missing = []
+        for path in paths:
+            key = path_key(path)
+            if key in self._cache:
+                continue
+            entry = self._find(key)
+            if entry is not None:
+                missing.append((entry[2], entry[3], key))
+        missing.sort()
+        if missing and hasattr(self._data, "madvise"):
+            for offset, size, _ in missing:
+                start = offset - offset % mmap.PAGESIZE
+                self._data.madvise(mmap.MADV_WILLNEED, start, offset + size - start)
+        for offset, size, key in missing:
+            self._load(key, offset, size)
+
+    def write(self, items: Iterable[tuple[str, bytes, State]]):
+        # Appends the States and rewrites the index, states of paths already in the
+        # store replace the old ones. The old data stays in the data file.
+        entries = {}
+        for position in range(self._count):
+            entry = self._entry(position)
+            entries[entry[0]] = entry
+        data_path = os.path.join(self.directory, data_name)
+        with open(data_path, "ab") as f:
+            offset = f.tell()
+            for path, oid, state in items:
+                key = path_key(path)
+                size = 0
+                for part in _layout(state):
+                    f.write(part)
+                    size += len(part)
+                entries[key] = (key, oid, offset, size)
+                offset += size
+                cached = self._cache.pop(key, None)
+                if cached is not None:
+                    self._used -= cached[1]
+        index_path = os.path.join(self.directory, index_name)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_header.pack(_magic, _version, len(entries)))
+            for key in sorted(entries):
+                f.write(_entry.pack(*entries[key]))
+        self.close()
+        os.replace(tmp_path, index_path)
+        self._open()
+
+    def __enter__(self) -> Store:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
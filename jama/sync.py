@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from typing import BinaryIO, Iterable
+
+from .change import Change, InconsistentError, Move, State, _mask
+from .codec import (
+    decode_change,
+    encode_change,
+    read_message,
+    read_varint,
+    write_message,
+    write_varint,
+)
+from .treap import mix
+
+# Range-based set reconciliation over the changes in the history of two states. Equal
+# changes can occur more than once, for example a Delete, its Revert and the Delete
+# again, so the items are occurrences: the fingerprint of the change mixed with how many
+# equal changes came before it in history. Both sides start with the range covering all fingerprints and compare
+# (count, sum) of the range. Differing ranges are split until they are small enough to
+# send the items, so the data exchanged is proportional to the difference times the
+# depth of the splitting.
+#
+# Moves don't commute with concurrent edits at the old boundaries of the moved run, so
+# replicas could diverge without an error. sync rejects them, on both sides.
+#
+# Protocol: the initiator sends a message with the full range, then the sides take turns
+# replying to each other, until one side has nothing to reply. Then the initiator sends
+# the changes the responder is missing followed by the responder doing the same.
+
+_fingerprint = 0
+_items = 1
+_want = 2
+
+full_range = (0, _mask + 1)
+# Ranges with less items are sent as item lists instead of being split
+threshold = 16
+branches = 16
+
+
+def _item(fingerprint: int, occurrence: int) -> int:
+    # The first occurrence is the fingerprint itself
+    if not occurrence:
+        return fingerprint
+    return mix(fingerprint ^ mix(occurrence))
+
+
+class ChangeSet(object):
+    __slots__ = ("changes", "counts", "items", "sums")
+
+    def __init__(self, history: Iterable[Change]):
+        changes: dict[int, Change] = {}
+        # fingerprint -> occurrences in history
+        self.counts: dict[int, int] = {}
+        for change in history:
+            changes[self.add(change.fingerprint())] = change
+        self.changes = changes
+        self.items = sorted(changes)
+        sums = [0]
+        total = 0
+        for item in self.items:
+            total = (total + item) & _mask
+            sums.append(total)
+        self.sums = sums
+
+    def add(self, fingerprint: int) -> int:
+        # The item of the next occurrence of fingerprint
+        occurrence = self.counts.get(fingerprint, 0)
+        self.counts[fingerprint] = occurrence + 1
+        return _item(fingerprint, occurrence)
+
+    def span(self, lower: int, upper: int) -> tuple[int, int]:
+        items = self.items
+        return bisect_left(items, lower), bisect_left(items, upper)
+
+    def fingerprint(self, left: int, right: int) -> int:
+        return (self.sums[right] - self.sums[left]) & _mask
+
+
+class Reconciler(object):
+    __slots__ = ("changes", "push", "_upper")
+
+    def __init__(self, changes: ChangeSet):
+        self.changes = changes
+        # Fingerprints the peer is missing and will get from us
+        self.push: set[int] = set()
+        self._upper = 0
+
+    def start(self) -> bytes:
+        out = bytearray()
+        self._upper = 0
+        self._send_fingerprint(out, *full_range)
+        return bytes(out)
+
+    def _write_range(self, out: bytearray, lower: int, upper: int, mode: int):
+        # Ranges are mostly contiguous, the lower bound is relative to the last upper
+        write_varint(out, lower - self._upper)
+        write_varint(out, upper - lower)
+        out.append(mode)
+        self._upper = upper
+
+    def _send_fingerprint(self, out: bytearray, lower: int, upper: int):
+        left, right = self.changes.span(lower, upper)
+        self._write_range(out, lower, upper, _fingerprint)
+        write_varint(out, right - left)
+        write_varint(out, self.changes.fingerprint(left, right))
+
+    def _send_items(self, out: bytearray, lower: int, upper: int):
+        left, right = self.changes.span(lower, upper)
+        self._write_range(out, lower, upper, _items)
+        write_varint(out, right - left)
+        for item in self.changes.items[left:right]:
+            write_varint(out, item)
+
+    def _split(self, out: bytearray, lower: int, upper: int, left: int, right: int):
+        items = self.changes.items
+        step = (right - left) // branches
+        bounds = [lower]
+        for i in range(1, branches):
+            bound = items[left + i * step]
+            if bound > bounds[-1]:
+                bounds.append(bound)
+        bounds.append(upper)
+        for i in range(len(bounds) - 1):
+            self._send_fingerprint(out, bounds[i], bounds[i + 1])
+
+    def _on_fingerprint(self, out: bytearray, lower, upper, count, fingerprint):
+        left, right = self.changes.span(lower, upper)
+        if count == right - left and fingerprint == self.changes.fingerprint(
+            left, right
+        ):
+            return
+        if count == 0 or right - left <= threshold:
+            self._send_items(out, lower, upper)
+        else:
+            self._split(out, lower, upper, left, right)
+
+    def _on_items(self, out: bytearray, lower, upper, theirs: set[int]):
+        left, right = self.changes.span(lower, upper)
+        mine = set(self.changes.items[left:right])
+        self.push.update(mine - theirs)
+        want = theirs - mine
+        if want:
+            self._write_range(out, lower, upper, _want)
+            write_varint(out, len(want))
+            for item in sorted(want):
+                write_varint(out, item)
+
+    def receive(self, data: bytes) -> bytes:
+        out = bytearray()
+        self._upper = 0
+        upper = 0
+        pos = 0
+        while pos < len(data):
+            lower, pos = read_varint(data, pos)
+            lower += upper
+            upper, pos = read_varint(data, pos)
+            upper += lower
+            mode = data[pos]
+            pos += 1
+            if mode == _fingerprint:
+                count, pos = read_varint(data, pos)
+                fingerprint, pos = read_varint(data, pos)
+                self._on_fingerprint(out, lower, upper, count, fingerprint)
+            else:
+                size, pos = read_varint(data, pos)
+                items = set()
+                for _ in range(size):
+                    item, pos = read_varint(data, pos)
+                    items.add(item)
+                if mode == _items:
+                    self._on_items(out, lower, upper, items)
+                else:
+                    self.push.update(items)
+        return bytes(out)
+
+
+def _send_changes(stream: BinaryIO, state: State, push: set[int]):
+    # In history order, so the peer can apply them in causal order. The occurrences of a
+    # change both sides have are a prefix of the ones the sender has, so the peer counts
+    # the same occurrences for the changes it receives.
+    out = bytearray()
+    counts: dict[int, int] = {}
+    for change in state.history:
+        fingerprint = change.fingerprint()
+        occurrence = counts.get(fingerprint, 0)
+        counts[fingerprint] = occurrence + 1
+        item = _item(fingerprint, occurrence)
+        if item in push:
+            push.discard(item)
+            encode_change(out, change)
+    write_message(stream, bytes(out))
+
+
+def _receive_changes(
+    stream: BinaryIO, state: State, changes: ChangeSet, check: bool
+) -> State:
+    data = read_message(stream)
+    pos = 0
+    received = state
+    try:
+        while pos < len(data):
+            change, pos = decode_change(data, pos, check)
+            if isinstance(change, Move):
+                raise ValueError("Moves can't be synced")
+            changes.changes[changes.add(change.fingerprint())] = change
+            received = change.apply(received)
+        if check and received is not state:
+            received.validate()
+    except (AssertionError, IndexError, ValueError) as e:
+        if not check:
+            raise
+        raise InconsistentError("invalid changes from peer: {0!r}".format(e))
+    return received
+
+
+def sync(state: State, stream: BinaryIO, initiator: bool, check: bool = True) -> State:
+    # The peer is not trusted with check, the received changes and the resulting state
+    # are validated and InconsistentError is raised if they are invalid.
+    changes = ChangeSet(state.history)
+    if any(isinstance(x, Move) for x in changes.changes.values()):
+        raise ValueError("Moves can't be synced")
+    reconciler = Reconciler(changes)
+    if initiator:
+        write_message(stream, reconciler.start())
+    while True:
+        message = read_message(stream)
+        if not message:
+            break
+        reply = reconciler.receive(message)
+        write_message(stream, reply)
+        if not reply:
+            break
+    if initiator:
+        _send_changes(stream, state, reconciler.push)
+        state = _receive_changes(stream, state, changes, check)
+    else:
+        state = _receive_changes(stream, state, changes, check)
+        _send_changes(stream, state, reconciler.push)
+    return state
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Iterable, Optional
+
+# Persistent treaps ordered by position, for the piece table and the position index.
+# A node covers weight positions, subtree sizes count positions. Nodes are never
+# changed, split and merge copy the O(log n) nodes on their path and all versions share
+# the other subtrees.
+
+_mask = (1 << 64) - 1
+
+
+def mix(x: int) -> int:
+    # splitmix64 finalizer. Deterministic, so priorities derived from the payload build
+    # equal trees for equal edits, and fingerprints are stable across processes.
+    x = (x + 0x9E3779B97F4A7C15) & _mask
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _mask
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _mask
+    return x ^ (x >> 31)
+
+
+class Node(object):
+    # Subclasses add the payload and set all slots in their constructor, size is the
+    # weight of the node plus the sizes of its children
+    __slots__ = ("priority", "left", "right", "size")
+
+    def with_children(self, left, right) -> Node:
+        raise NotImplementedError()
+
+    def cut(self, offset: int) -> tuple[Node, Node]:
+        # The first offset positions with the left subtree and a leaf with the rest,
+        # only called for nodes with a weight above one
+        raise NotImplementedError()
+
+
+def size(node: Optional[Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def merge(a: Optional[Node], b: Optional[Node]) -> Optional[Node]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        return a.with_children(a.left, merge(a.right, b))
+    return b.with_children(merge(a, b.left), b.right)
+
+
+def split(node: Optional[Node], offset: int):
+    # Returns the positions before offset and the positions from offset
+    if node is None:
+        return None, None
+    left_size = size(node.left)
+    if offset <= left_size:
+        left, right = split(node.left, offset)
+        return left, node.with_children(right, node.right)
+    offset -= left_size
+    weight = node.size - left_size - size(node.right)
+    if offset < weight:
+        head, tail = node.cut(offset)
+        return head, merge(tail, node.right)
+    left, right = split(node.right, offset - weight)
+    return node.with_children(node.left, left), right
+
+
+def build(
+    items: Iterable[tuple[int, Any]], make: Callable[..., Node]
+) -> Optional[Node]:
+    # Cartesian tree of (priority, payload) items in O(n): the right spine is kept on a
+    # stack. Nodes are mutable until the tree is built, so children are collected
+    # first. make(payload, priority, left, right) builds the nodes.
+    stack: list[list] = []
+    for priority, payload in items:
+        node = [priority, payload, None, None]
+        last = None
+        while stack and stack[-1][0] < priority:
+            last = stack.pop()
+        node[2] = last
+        if stack:
+            stack[-1][3] = node
+        stack.append(node)
+    if not stack:
+        return None
+
+    def freeze(node):
+        if node is None:
+            return None
+        priority, payload, left, right = node
+        return make(payload, priority, freeze(left), freeze(right))
+
+    return freeze(stack[0])
+
+
+def inorder(node: Optional[Node]) -> Iterable[Any]:
+    stack = []
+    while stack or node is not None:
+        if node is not None:
+            stack.append(node)
+            node = node.left
+            continue
+        node = stack.pop()
+        yield node
+        node = node.right
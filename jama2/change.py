@@ -10,6 +10,8 @@ from attr import dataclass
 from pyrsistent import pset, pvector
 from pyrsistent.typing import PSet, PVector
 
+from jama import core
+
 # Rules
 # =====
 #
@@ -51,8 +53,8 @@ from pyrsistent.typing import PSet, PVector
 # commutation opertunities
 
 
-class InconsistentError(Exception):
-    pass
+# The core raises it for cycles and unreachable ends, so it is the same class
+InconsistentError = core.InconsistentError
 
 
 class ConflictError(Exception):
@@ -188,6 +190,19 @@ def collect_deleted_nodes(edges: PSet[Edge], nodes: PVector[bool]) -> set[Edge]:
     return edges
 
 
+def encode_node(node: Node) -> int:
+    # Into the int node ids of jama.core
+    if node is Nodes.start:
+        return core.START
+    if node is Nodes.end:
+        return core.END
+    return cast(int, node) + core.CONTENT
+
+
+def encode_edges(edges: Iterable[Edge]) -> PSet[tuple[int, int]]:
+    return pset((encode_node(a), encode_node(b)) for a, b in edges)
+
+
 def node_list_to_edges(
     nodes: Iterable[Node],
     start: Node = Nodes.start,
@@ -200,13 +215,23 @@ def node_list_to_edges(
     yield (prev, end)
 
 
-# State is something like a CRDT
+# State is something like a CRDT. core_edges mirrors edges in the int node ids of
+# jama.core, it is kept up to date by the changes, so to_file does not encode the graph.
 @dataclass(slots=True, frozen=True)
 class State(object):
     nodes: PVector[bool]
     edges: PSet[Edge]
     max_node: int
     history: PVector[Change]
+    core_edges: PSet[tuple[int, int]]
+
+    core_edges = cast(
+        PSet[tuple[int, int]], attr.ib(default=None, eq=False, repr=False)
+    )
+
+    def __attrs_post_init__(self):
+        if self.core_edges is None:
+            object.__setattr__(self, "core_edges", encode_edges(self.edges))
 
     @classmethod
     def from_graph(cls, nodes: Iterable[bool], edges: Iterable[Edge]):
@@ -228,10 +253,14 @@ class State(object):
         return cls(nodes, pset(node_list_to_edges(node_list)), max_node, pvector())
 
     def to_file(self) -> FileRepr:
-        edges = collect_deleted_nodes(self.edges, self.nodes)
-        edges = get_outgoing(edges)
-        node_list = edges_to_node_list(edges)
-        return FileRepr(pvector(node_list))
+        # Projected by the int core of jama, collect_deleted_nodes and
+        # edges_to_node_list are the old projection
+        nodes = [True, True]
+        nodes.extend(self.nodes)
+        seq, lo, _, _ = core.order(nodes, self.core_edges)
+        if core.gaps(seq, lo):
+            raise ConflictError()
+        return FileRepr(pvector(x - core.CONTENT for x in seq[1:-1]))
 
     def has_conflict(self) -> bool:
         raise NotImplementedError()
@@ -242,6 +271,7 @@ class State(object):
             self.edges,
             self.max_node,
             self.history.append(change),
+            self.core_edges,
         )
 
     def insert(self, change: Insert) -> State:
@@ -261,12 +291,16 @@ class State(object):
             )
         )
         edges = self.edges
-        try:
-            edges = edges.remove((change.predecessor, change.successor))
-        except KeyError:
-            pass
+        core_edges = self.core_edges
+        replaced = (change.predecessor, change.successor)
+        if replaced in edges:
+            edges = edges.remove(replaced)
+            core_edges = core_edges.remove(
+                (encode_node(replaced[0]), encode_node(replaced[1]))
+            )
         edges = edges.update(inserts)
-        return State(nodes, edges, max_node, self.history.append(change))
+        core_edges = core_edges.update(encode_edges(inserts))
+        return State(nodes, edges, max_node, self.history.append(change), core_edges)
 
 
 @dataclass(slots=True, frozen=True)
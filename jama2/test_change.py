@@ -1,8 +1,8 @@
 import pytest
 from hypothesis import example, given, strategies as st
 
-from jama import change as cmod
-from jama.change import Nodes
+from jama2 import change as cmod
+from jama2.change import Nodes
 
 max_size = 10
 resolution = max_size * max_size * 4
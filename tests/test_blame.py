@@ -0,0 +1,113 @@
+import attr
+import pygit2  # type: ignore
+from click.testing import CliRunner
+from pyrsistent import pvector
+
+from jama import change as cmod
+from jama.blame import blame
+from jama.cli import run
+from jama.git import cached_replay, replay
+from jama.store import Store
+
+cn = cmod.FileNodes.content
+
+
+def test_blame_commits():
+    state = cmod.State.from_file(cmod.FileRepr.from_user(pvector(range(3))))
+    commits = []
+    commits.append((len(state.history), "a"))
+    state = cmod.Insert(cn + 0, [cn + 3, cn + 4], cn + 1).apply(state)
+    commits.append((len(state.history), "b"))
+    state = cmod.Delete(cn + 1).apply(state)
+    state = cmod.Insert(cn + 4, [cn + 5], cn + 2).apply(state)
+    lines = list(blame(state, commits, base="base"))
+    assert [x.uid for x in lines] == list(state.to_file().node_list)
+    assert [x.commit for x in lines] == ["base", "a", "a", "b", "base"]
+    assert [x.index for x in lines] == [None, 0, 0, 2, None]
+    assert lines[3].change == state.history[2]
+
+
+def _commit(repo, path, data, message, parents):
+    blob = repo.create_blob(data)
+    builder = repo.TreeBuilder(repo[parents[0]].tree) if parents else repo.TreeBuilder()
+    builder.insert(path, blob, pygit2.GIT_FILEMODE_BLOB)
+    signature = pygit2.Signature("test", "test@example.com")
+    return repo.create_commit(
+        "HEAD", signature, signature, message, builder.write(), parents
+    )
+
+
+def test_blame_git(tmp_path):
+    repo = pygit2.init_repository(str(tmp_path))
+    first = _commit(repo, "a.txt", b"a\nb\nc\n", "first", [])
+    second = _commit(repo, "b.txt", b"x\n", "other file", [first])
+    third = _commit(repo, "a.txt", b"a\nB\nc\nd\n", "third", [second])
+    result = replay(repo, "a.txt")
+    assert [x[1] for x in result.commits] == [str(first), str(third)]
+    lines = list(blame(result.state, result.commits))
+    assert [result.content[x.uid] for x in lines] == [b"a\n", b"B\n", b"c\n", b"d\n"]
+    assert [x.commit for x in lines] == [str(first), str(third), str(first), str(third)]
+
+    output = CliRunner().invoke(run, ["blame", "--repo", str(tmp_path), "a.txt"])
+    assert output.exit_code == 0, output.output
+    rows = output.output.splitlines()
+    assert len(rows) == 4
+    assert rows[1].startswith(str(third)[:8])
+    assert rows[1].endswith(") B")
+
+
+def _check_same(result, full):
+    assert result.state == full.state
+    assert result.commits == full.commits
+    assert result.head == full.head
+    lines = list(blame(result.state, result.commits))
+    full_lines = list(blame(full.state, full.commits))
+    assert [x.commit for x in lines] == [x.commit for x in full_lines]
+    assert [result.content[x.uid] for x in lines] == [
+        full.content[x.uid] for x in full_lines
+    ]
+
+
+def test_replay_since(tmp_path):
+    repo = pygit2.init_repository(str(tmp_path))
+    first = _commit(repo, "a.txt", b"a\nb\nc\n", "first", [])
+    since = replay(repo, "a.txt")
+    assert since.head == str(first)
+    second = _commit(repo, "b.txt", b"x\n", "other file", [first])
+    third = _commit(repo, "a.txt", b"a\nB\nc\nd\n", "third", [second])
+    _commit(repo, "a.txt", b"B\nd\n", "fourth", [third])
+    _check_same(replay(repo, "a.txt", since=since), replay(repo, "a.txt"))
+    # Only the commits after since are replayed
+    marked = attr.evolve(since, commits=[(0, "marked")])
+    assert replay(repo, "a.txt", since=marked).commits[0] == (0, "marked")
+    assert replay(repo, "a.txt", str(second), since).state == since.state
+    # since is not an ancestor of rev: everything is replayed
+    later = replay(repo, "a.txt")
+    _check_same(
+        replay(repo, "a.txt", str(second), later), replay(repo, "a.txt", str(second))
+    )
+
+
+def test_cached_replay(tmp_path):
+    repo = pygit2.init_repository(str(tmp_path / "repo"))
+    first = _commit(repo, "a.txt", b"a\nb\nc\n", "first", [])
+    with Store(str(tmp_path / "store")) as store:
+        result = cached_replay(repo, store, "a.txt")
+        assert store.oid("a.txt") == first.raw
+    second = _commit(repo, "a.txt", b"a\nB\nc\nd\n", "second", [first])
+    with Store(str(tmp_path / "store")) as store:
+        result = cached_replay(repo, store, "a.txt")
+        assert store.misses == 1
+        assert store.oid("a.txt") == second.raw
+        _check_same(result, replay(repo, "a.txt"))
+    with Store(str(tmp_path / "store")) as store:
+        _check_same(cached_replay(repo, store, "a.txt"), result)
+
+    for args in (["--no-cache"], [], []):
+        output = CliRunner().invoke(
+            run, ["blame", "--repo", str(tmp_path / "repo"), "a.txt"] + args
+        )
+        assert output.exit_code == 0, output.output
+        rows = output.output.splitlines()
+        assert rows[1].startswith(str(second)[:8])
+        assert rows[1].endswith(") B")
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import jama.change as cmod
+from jama.cache import DiffCache
+
+
+def files():
+    base = cmod.FileReprEdit.from_size(10)
+    return base, base.insert(3, 2).delete(7, 2), base.delete(0, 4)
+
+
+def test_fingerprint():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    assert a.fingerprint() == cmod.FileReprEdit.from_size(3).fingerprint()
+    assert a.fingerprint() != cmod.FileRepr.from_user([0, 2, 1]).fingerprint()
+    assert len(a.fingerprint()) == 16
+
+
+def test_lru():
+    base, a, b = files()
+    cache = DiffCache(size=2)
+    expected = list(cmod.Change.from_diff(base, a))
+    assert cache.diff(base, a) == expected
+    assert cache.diff(base, a) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.diff(base, b)
+    cache.diff(base, a)
+    cache.diff(a, b)
+    assert len(cache) == 2
+    # base, b was least recently used
+    cache.diff(base, b)
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_directory(tmp_path):
+    base, a, b = files()
+    directory = str(tmp_path / "cache")
+    cache = DiffCache(directory=directory)
+    expected = cache.diff(base, a)
+    cache = DiffCache(directory=directory)
+    assert cache.diff(base, a) == expected
+    assert (cache.hits, cache.misses) == (1, 0)
+    for path in (tmp_path / "cache").iterdir():
+        path.write_bytes(b"\x07")
+    cache = DiffCache(directory=directory)
+    assert cache.diff(base, a) == expected
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_disk_size(tmp_path):
+    base, a, b = files()
+    directory = str(tmp_path / "cache")
+    cache = DiffCache(directory=directory)
+    cache.diff(base, a)
+    entry = sum(x.stat().st_size for x in (tmp_path / "cache").iterdir())
+    cache = DiffCache(directory=directory, disk_size=entry)
+    cache.diff(base, b)
+    # base, a was evicted from disk
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+    cache = DiffCache(directory=directory, disk_size=entry)
+    cache.diff(base, a)
+    assert (cache.hits, cache.misses) == (0, 1)
+    # A budget smaller than the directory evicts when the cache is opened
+    DiffCache(directory=directory, disk_size=0)
+    assert not list((tmp_path / "cache").iterdir())
+
+
+def test_store_failure(tmp_path, monkeypatch):
+    base, a, _ = files()
+    directory = tmp_path / "cache"
+    cache = DiffCache(directory=str(directory))
+
+    def fail(path, target):
+        raise OSError("full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        cache.diff(base, a)
+    assert not list(directory.iterdir())
+
+
+def test_fingerprint_cached():
+    a = cmod.FileReprEdit.from_size(3)
+    assert a.digest is None
+    assert a.fingerprint() is a.fingerprint()
+    assert a.insert(0, 1).digest is None
+    assert a == cmod.FileReprEdit.from_size(3)
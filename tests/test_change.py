@@ -1,7 +1,10 @@
 import pytest
+from hypothesis import example, given, strategies as st
 
 import jama.change as cmod
 
+cn = cmod.FileNodes.content
+
 
 def test_file_repr():
     file_ = cmod.FileRepr.from_user([0])
@@ -186,3 +189,440 @@ def test_complex_del():
         (3, 2),
         (2, cmod.FileNodes.end),
     }
+
+
+def test_fingerprint():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    assert b.fingerprint == cmod.graph_fingerprint(b.nodes, b.edges)
+    assert b.history_fingerprint == 0
+    assert hash(b) == b.fingerprint
+    c = cmod.Delete.from_user(1)
+    i = cmod.Insert.from_user(0, [3], 2)
+    d = i.apply(c.apply(b))
+    e = c.apply(i.apply(b))
+    assert d != e
+    assert d.fingerprint == e.fingerprint
+    assert d.history_fingerprint != e.history_fingerprint
+    assert d.fingerprint != b.fingerprint
+    assert d.fingerprint == cmod.graph_fingerprint(d.nodes, d.edges)
+    f = cmod.State(d.nodes, d.edges, d.max_node, d.history)
+    assert f == d
+    assert f.fingerprint == d.fingerprint
+    assert f.history_fingerprint == d.history_fingerprint
+    g = c.apply(d)
+    assert g.fingerprint == d.fingerprint
+    assert g.history_fingerprint != d.history_fingerprint
+    assert len({d, e, f}) == 2
+
+
+def test_fingerprint_insert():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    c = cmod.Insert.from_user(0, [3], 1).apply(b)
+    assert c.fingerprint == cmod.graph_fingerprint(c.nodes, c.edges)
+    d = cmod.Insert.from_user(0, [4], 1).apply(c)
+    assert d.fingerprint == cmod.graph_fingerprint(d.nodes, d.edges)
+
+
+def test_pack_uid():
+    cn = cmod.FileNodes.content
+    assert cmod.pack_uid(0, 0) == cn
+    assert cmod.unpack_uid(cmod.pack_uid(5, 3)) == (5, 3)
+    assert cmod.pack_uid(1, 0) > cmod.pack_uid(0, cmod.MAX_REPLICAS - 1)
+    assert cmod.unpack_uid(cmod.pack_uid(5, 1000, 10), 10) == (5, 1000)
+    with pytest.raises(AssertionError):
+        cmod.pack_uid(0, cmod.MAX_REPLICAS)
+
+
+def test_replica_bits():
+    # Many writers on one document, each with its own replica id
+    base = cmod.FileReprEdit.from_size(3)
+    state = cmod.State.from_file(base)
+    sides = []
+    for gap, replica in enumerate((0, 17, 700, 1023)):
+        side = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, replica, 10)
+        if gap % 2:
+            sides.append(side.insert(gap, 2))
+        else:
+            session = side.edit()
+            session.insert(gap, 2)
+            sides.append(session.finish())
+    uids = [set(x.node_list) - set(base.node_list) for x in sides]
+    assert sum(len(x) for x in uids) == len(set().union(*uids)) == 8
+    for side in sides:
+        for change in cmod.Change.from_diff(base, side):
+            state = change.apply(state)
+    assert len(state.to_file().node_list) == 11
+    with pytest.raises(AssertionError):
+        cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1024, 10)
+
+
+def test_replica_edit():
+    base = cmod.FileReprEdit.from_size(3)
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2)
+    assert a.insert(0, 0) is a
+    a1 = a.insert(1, 2)
+    b1 = b.insert(1, 1).delete(0, 1)
+    assert isinstance(b1, cmod.ReplicaFileReprEdit)
+    assert not set(a1.node_list) & (set(b1.node_list) - set(base.node_list))
+    assert [cmod.unpack_uid(x)[1] for x in a1.node_list[1:3]] == [1, 1]
+    assert b1.observe(a1.max_uid).max_uid == a1.max_uid
+    assert a1.observe(0) is a1
+    with pytest.raises(IndexError):
+        a.insert(4, 1)
+    state = cmod.State.from_file(base)
+    changes_a = list(cmod.Change.from_diff(base, a1))
+    changes_b = list(cmod.Change.from_diff(base, b1))
+    c = state
+    for change in changes_a + changes_b:
+        c = change.apply(c)
+    d = state
+    for change in changes_b + changes_a:
+        d = change.apply(d)
+    assert c.fingerprint == d.fingerprint
+    assert c.max_node == d.max_node == a1.max_uid
+    with pytest.raises(AssertionError):
+        changes_a[0].apply(c)
+
+
+def test_insert_tombstone():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 1, 2]))
+    deleted = cmod.Delete.from_user(1).apply(state)
+    # Hidden lines are still in the graph, inserting them again would add a cycle
+    with pytest.raises(AssertionError):
+        cmod.Insert.from_user(2, [1], -1).apply(deleted)
+    # The provenance index knows the line, without history it is a tombstone
+    assert deleted.tombstones == set()
+    rebuilt = cmod.State(deleted.nodes, deleted.edges, deleted.max_node, [])
+    assert rebuilt.tombstones == {cn + 1}
+    with pytest.raises(AssertionError):
+        cmod.Insert.from_user(2, [1], -1).apply(rebuilt)
+    reverted = cmod.Insert.from_user(2, [3], -1).apply(deleted).revert_indices([1])
+    with pytest.raises(AssertionError):
+        cmod.Insert.from_user(2, [3], -1).apply(reverted)
+
+
+max_size = 10
+resolution = max_size * max_size * 4
+over = 3
+
+
+def cap(x):
+    x /= resolution
+    if x > 1.0:
+        return 1.0
+    if x < 0.0:
+        return 0.0
+    return x
+
+
+over_range = st.integers(-over, resolution + over).map(cap)
+insert = st.tuples(st.just("insert"), over_range, st.integers(0, max_size))
+delete = st.tuples(st.just("delete"), over_range, over_range)
+change = st.one_of(insert, delete)
+
+
+def edit(cur, ct, pos, size):
+    if ct == "insert":
+        return cur.insert(int(pos * len(cur)), size)
+    rest = 1.0 - pos
+    len_cur = len(cur)
+    return cur.delete(int(pos * len_cur), int(size * rest * len_cur))
+
+
+@given(st.integers(0, max_size), st.lists(change))
+@example(
+    initial=2,
+    changes=[("delete", 0.0, 0.5), ("insert", 0.0, 1)],
+)
+def test_gen_changes(initial, changes):
+    cur = cmod.FileReprEdit.from_size(initial)
+    state = cmod.State.from_file(cur)
+    for ct, pos, size in changes:
+        prev = cur
+        cur = edit(cur, ct, pos, size)
+        for change in cmod.Change.from_diff(prev, cur):
+            state = change.apply(state)
+        assert state.to_file().node_list == cur.node_list
+
+
+@given(st.integers(1, max_size), st.lists(change), st.lists(change))
+def test_gen_concurrent(initial, changes_a, changes_b):
+    base = cmod.FileReprEdit.from_size(initial)
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2)
+    for ct, pos, size in changes_a:
+        a = edit(a, ct, pos, size)
+    for ct, pos, size in changes_b:
+        b = edit(b, ct, pos, size)
+    state = cmod.State.from_file(base)
+    state_a = state
+    for change in cmod.Change.from_diff(base, a):
+        state_a = change.apply(state_a)
+    state_b = state
+    for change in cmod.Change.from_diff(base, b):
+        state_b = change.apply(state_b)
+    for change in cmod.Change.from_diff(base, b):
+        state_a = change.apply(state_a)
+    for change in cmod.Change.from_diff(base, a):
+        state_b = change.apply(state_b)
+    linear = state_a.linearize()
+    assert linear == state_b.linearize()
+    deleted = (set(base.node_list) - set(a.node_list)) | (
+        set(base.node_list) - set(b.node_list)
+    )
+    visible = (set(a.node_list) | set(b.node_list)) - deleted
+    assert sorted(linear.file_.node_list) == sorted(visible)
+    for conflict in linear.conflicts:
+        assert conflict.start < conflict.end
+        assert conflict.sides[0][0] == conflict.start
+        assert conflict.sides[-1][1] == conflict.end
+        for (_, end), (start, _) in zip(conflict.sides, conflict.sides[1:]):
+            assert end == start
+        assert all(start < end for start, end in conflict.sides)
+
+
+def test_linearize():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    linear = b.linearize()
+    assert linear.file_ == a
+    assert linear.conflicts == []
+    c = cmod.Delete.from_user(1).apply(b)
+    d = cmod.Insert.from_user(0, [3], 2).apply(c)
+    assert d.to_file().to_user() == [0, 3, 2]
+    e = cmod.Insert.from_user(0, [4, 5], 2).apply(d)
+    linear = e.linearize()
+    assert linear.file_.to_user() == [0, 4, 5, 3, 2]
+    cn = cmod.FileNodes.content
+    assert linear.conflicts == [cmod.Conflict(1, 4, [(1, 3), (3, 4)], [1 + cn])]
+    with pytest.raises(cmod.ConflictError) as error:
+        e.to_file()
+    assert error.value.args[0] == linear
+
+
+def test_linearize_one_sided():
+    a = cmod.FileRepr.from_user([0])
+    b = cmod.State.from_file(a)
+    c = cmod.Insert.from_user(cmod.FileNodes.start, [1], cmod.FileNodes.end).apply(b)
+    linear = c.linearize()
+    assert linear.file_.to_user() == [1, 0]
+    assert linear.conflicts == [cmod.Conflict(0, 2, [(0, 1), (1, 2)], [])]
+    d = cmod.Delete.from_user(0).apply(c)
+    assert d.to_file().to_user() == [1]
+
+
+def test_linearize_inconsistent():
+    nodes = [True, True, True, True]
+    b = cmod.State.from_graph(nodes, {(0, 2), (2, 3), (3, 2)}, check=False)
+    with pytest.raises(cmod.InconsistentError):
+        b.linearize()
+    b = cmod.State.from_graph([True, True, True], {(0, 2)}, check=False)
+    with pytest.raises(cmod.InconsistentError):
+        b.linearize()
+
+
+def test_validate():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 1]))
+    state.validate()
+    cmod.State.from_file(cmod.FileRepr([])).validate()
+    assert cmod.State.from_graph(state.nodes, state.edges) == state
+    for nodes, edges in [
+        ([True, True, True, True], {(0, 2), (2, 3), (3, 2), (2, 1)}),
+        ([True, True, True], {(0, 2)}),
+        ([True, True, True], {(0, 2), (2, 1), (2, 5)}),
+        ([True, True, True, True], {(0, 2), (2, 1), (3, 1)}),
+        ([True, True, True, True], {(0, 2), (2, 1)}),
+        ([True, False, True], {(0, 2), (2, 1)}),
+        ([True, True, True], {(0, 2), (2, 1), (1, 2)}),
+    ]:
+        with pytest.raises(cmod.InconsistentError):
+            cmod.State.from_graph(nodes, edges)
+    with pytest.raises(cmod.InconsistentError):
+        cmod.State(state.nodes, state.edges, 7, state.history).validate()
+
+
+def test_unchecked():
+    insert = cmod.Insert.unchecked(cn, [cn + 5], cn + 1)
+    assert insert == cmod.Insert(cn, [cn + 5], cn + 1)
+    assert insert.lines == [cn + 5]
+    assert cmod.Delete.unchecked(cn) == cmod.Delete(cn)
+    assert cmod.Move.unchecked(cn, (cn + 2,), cn + 1) == cmod.Move(cn, [cn + 2], cn + 1)
+    # Nothing is checked
+    assert cmod.Delete.unchecked(cmod._IntFileNodes.end).line == 1
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 1]))
+    replayed = state.replay([insert, cmod.Delete.unchecked(cn)])
+    assert replayed.to_file().to_user() == [5, 1]
+
+
+def test_provenance():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    i = cmod.Insert.from_user(0, [3, 4], 1)
+    d1 = cmod.Delete.from_user(1)
+    d2 = cmod.Delete.from_user(3)
+    c = d2.apply(d1.apply(i.apply(b)))
+    assert c.created_by(3 + cn) == i
+    assert c.created_by(0 + cn) is None
+    assert c.hidden_by(1 + cn) == [d1]
+    assert c.hidden_by(0 + cn) == []
+    d = cmod.State(c.nodes, c.edges, c.max_node, c.history)
+    assert d.creators == c.creators
+    assert d.hiders == c.hiders
+
+
+def test_revert():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    i = cmod.Insert.from_user(0, [3, 4], 1)
+    d1 = cmod.Delete.from_user(1)
+    d2 = cmod.Delete.from_user(3)
+    c = d2.apply(d1.apply(i.apply(b)))
+    assert c.to_file().to_user() == [0, 4, 2]
+    e = c.revert_indices([1])
+    assert e.to_file().to_user() == [0, 4, 1, 2]
+    assert e.reverted == {1}
+    assert e.fingerprint == cmod.graph_fingerprint(e.nodes, e.edges)
+    f = cmod.Revert([i]).apply(c)
+    assert f.to_file().to_user() == [0, 2]
+    g = cmod.Revert([d2]).apply(f)
+    assert g.to_file().to_user() == [0, 2]
+    h = cmod.Revert([d1]).apply(g)
+    assert h.to_file().to_user() == [0, 1, 2]
+    assert h.fingerprint == cmod.graph_fingerprint(h.nodes, h.edges)
+    k = cmod.State(h.nodes, h.edges, h.max_node, h.history)
+    assert k.reverted == h.reverted
+    # Equal changes (from different replicas) are reverted together
+    m = cmod.Delete.from_user(0).apply(cmod.Delete.from_user(0).apply(b))
+    assert m.revert_indices([0]).reverted == {0, 1}
+    assert m.revert_indices([0]).to_file().to_user() == [0, 1, 2]
+    with pytest.raises(ValueError):
+        cmod.Revert([cmod.Delete.from_user(2)]).apply(c)
+    with pytest.raises(AssertionError):
+        cmod.Revert([cmod.Revert([d1])])
+
+
+def test_move():
+    a = cmod.FileReprEdit.from_size(6)
+    state = cmod.State.from_file(a)
+    b = cmod.FileReprEdit.from_user([3, 4, 0, 1, 2, 5])
+    with pytest.raises(ValueError):
+        list(cmod.Change.from_diff(a, b))
+    changes = list(cmod.Change.from_diff(a, b, moves=True))
+    assert changes == [cmod.Move(cmod._IntFileNodes.start, [cn + 3, cn + 4], cn + 0)]
+    moved = state
+    for change in changes:
+        moved = change.apply(moved)
+    assert moved.to_file().node_list == b.node_list
+    assert moved.max_node == state.max_node
+    assert len(moved.edges) == len(state.edges)
+    assert moved.fingerprint == cmod.graph_fingerprint(moved.nodes, moved.edges)
+    assert moved.created_by(cn + 1) is None
+    # An insert inside the moved run commutes with the move
+    insert = cmod.Insert(cn + 3, [cn + 6], cn + 4)
+    c = insert.apply(moved)
+    d = changes[0].apply(insert.apply(state))
+    assert c.linearize() == d.linearize()
+    assert c.to_file().to_user() == [3, 6, 4, 0, 1, 2, 5]
+    with pytest.raises(cmod.InconsistentError):
+        cmod.Move(cn + 3, [cn + 0, cn + 4], cn + 5).apply(state)
+
+
+@given(st.integers(1, max_size), st.lists(change), st.randoms())
+def test_gen_moves(initial, changes, rnd):
+    cur = cmod.FileReprEdit.from_size(initial)
+    state = cmod.State.from_file(cur)
+    for ct, pos, size in changes:
+        prev, cur = cur, edit(cur, ct, pos, size)
+        for change in cmod.Change.from_diff(prev, cur):
+            state = change.apply(state)
+    node_list = list(cur.node_list)
+    if len(node_list) > 1:
+        start = rnd.randrange(len(node_list))
+        end = rnd.randrange(start + 1, len(node_list) + 1)
+        block = node_list[start:end]
+        del node_list[start:end]
+        at = rnd.randrange(len(node_list) + 1)
+        node_list[at:at] = block
+    moved = cmod.FileReprEdit(node_list, cur.max_uid).insert(0, 1)
+    for change in cmod.Change.from_diff(cur, moved, moves=True):
+        assert not isinstance(change, cmod.Delete)
+        state = change.apply(state)
+    assert state.to_file().node_list == moved.node_list
+
+
+def apply_opcodes(a, b, opcodes):
+    result = []
+    a_pos = b_pos = 0
+    for tag, a_left, a_right, b_left, b_right in opcodes:
+        assert (a_left, b_left) == (a_pos, b_pos)
+        if tag == "equal":
+            assert a[a_left:a_right] == b[b_left:b_right]
+            result.extend(a[a_left:a_right])
+        else:
+            result.extend(b[b_left:b_right])
+        a_pos, b_pos = a_right, b_right
+    assert (a_pos, b_pos) == (len(a), len(b))
+    return result
+
+
+@given(st.lists(st.sampled_from("abcde")), st.lists(st.sampled_from("abcde")))
+def test_gen_stream_opcodes(a, b):
+    opcodes = list(cmod.stream_opcodes(iter(a), iter(b)))
+    assert apply_opcodes(a, b, opcodes) == b
+
+
+@given(st.integers(0, max_size), st.lists(change))
+def test_gen_diff_stream(initial, changes):
+    base = cur = cmod.FileReprEdit.from_size(initial)
+    for ct, pos, size in changes:
+        cur = edit(cur, ct, pos, size)
+    state = cmod.State.from_file(base)
+    for change in cmod.Change.from_diff_stream(iter(base.node_list), cur.node_list):
+        state = change.apply(state)
+    assert state.to_file().node_list == cur.node_list
+
+
+def test_diff_stream_moved():
+    # 3, 4 and 5 are anchors, 0, 1 and 2 are deleted before them and inserted again
+    # after them
+    a = cmod.FileReprEdit.from_size(6)
+    state = cmod.State.from_file(a)
+    b = cmod.FileRepr.from_user([3, 4, 5, 0, 1, 2])
+    changes = cmod.Change.from_diff_stream(a.node_list, b.node_list)
+    with pytest.raises(ValueError):
+        for change in changes:
+            state = change.apply(state)
+    state.validate()
+    # The insert comes first, it can't be applied
+    b = cmod.FileRepr.from_user([5, 0, 1, 2, 3, 4])
+    changes = cmod.Change.from_diff_stream(a.node_list, b.node_list)
+    first = next(changes)
+    assert first == cmod.Insert(cmod._IntFileNodes.start, [cn + 5], cn)
+    with pytest.raises(AssertionError):
+        first.apply(cmod.State.from_file(a))
+    with pytest.raises(ValueError):
+        list(changes)
+    b = cmod.FileRepr.from_user([1, 0, 2, 3, 4, 5])
+    with pytest.raises(ValueError):
+        list(cmod.Change.from_diff_stream(a.node_list, b.node_list))
+
+
+def test_diff_stream_bounded():
+    read = [0]
+
+    def lines(size, skip):
+        for x in range(size):
+            read[0] += 1
+            if x != skip:
+                yield x + cn
+
+    changes = cmod.Change.from_diff_stream(lines(100000, -1), lines(100000, 10))
+    assert next(changes) == cmod.Delete(cn + 10)
+    assert read[0] < 100
+    opcodes = cmod.stream_opcodes(lines(100000, -1), lines(100000, 10))
+    assert next(opcodes) == ("equal", 0, 10, 0, 10)
+    assert next(opcodes) == ("delete", 10, 11, 10, 10)
+    assert read[0] < 200
@@ -0,0 +1,123 @@
+import gc
+import math
+import time
+
+import pytest
+
+import jama.change as cmod
+
+# Runs the core operations at geometrically growing sizes and fits the exponent k of
+# time ~ size ** k. An operation fails if k exceeds the exponent of its complexity class
+# by more than the tolerance, which is loose enough for noisy machines, but catches a
+# linear operation turning quadratic or a logarithmic one turning linear.
+
+sizes = [2000, 4000, 8000, 16000, 32000]
+tolerance = 0.5
+repeat = 3
+# Exponents of the complexity classes, log factors count as 0
+log = 0.0
+linear = 1.0
+
+
+def timed(run, arg) -> float:
+    # Like timeit, without the garbage collector that scans all objects
+    best = math.inf
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(arg)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return max(best, 1e-9)
+
+
+def exponent(setup, run) -> float:
+    # Least squares slope of log(time) over log(size)
+    xs = []
+    ys = []
+    for size in sizes:
+        arg = setup(size)
+        xs.append(math.log(size))
+        ys.append(math.log(timed(run, arg)))
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    cov = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    var = sum((x - x_mean) ** 2 for x in xs)
+    return cov / var
+
+
+def edited(size):
+    # A file and a version with a constant number of edits spread over it
+    a = cmod.FileReprEdit.from_size(size)
+    b = a
+    for i in range(8):
+        offset = (i * 2 + 1) * len(b) // 17
+        b = b.insert(offset, 3) if i % 2 else b.delete(offset, 3)
+    return a, b
+
+
+def diffed(size):
+    a, b = edited(size)
+    return cmod.State.from_file(a), list(cmod.Change.from_diff(a, b))
+
+
+def apply_all(arg):
+    state, changes = arg
+    for change in changes:
+        state = change.apply(state)
+    return state
+
+
+def applied(size):
+    # The edited state, so to_file walks the paths around hidden lines
+    return apply_all(diffed(size))
+
+
+def file_edits(file_):
+    for _ in range(20):
+        file_ = file_.insert(len(file_) // 2, 1).delete(len(file_) // 3, 1)
+
+
+def session_edits(file_):
+    session = file_.edit()
+    for _ in range(200):
+        session.insert(len(session) // 2, 1).delete(len(session) // 3, 1)
+
+
+def indexed(size):
+    state = cmod.State.from_file(cmod.FileReprEdit.from_size(size))
+    state.position_index()
+    return state
+
+
+def position_edits(state):
+    for _ in range(20):
+        state = state.insert_at(len(state.positions) // 2, 1)
+
+
+def position_queries(state):
+    positions = state.positions
+    for i in range(200):
+        positions.index(positions[(i * 7919) % len(positions)])
+        positions.lines(i * 13, 20)
+
+
+cases = [
+    ("from_diff", edited, lambda x: list(cmod.Change.from_diff(*x)), linear),
+    ("apply", diffed, apply_all, log),
+    ("to_file", applied, lambda x: x.to_file(), linear),
+    ("file_edits", cmod.FileReprEdit.from_size, file_edits, linear),
+    ("session_edits", cmod.FileReprEdit.from_size, session_edits, log),
+    ("position_edits", indexed, position_edits, log),
+    ("position_queries", indexed, position_queries, log),
+]
+
+
+@pytest.mark.parametrize("name,setup,run,expected", cases, ids=[x[0] for x in cases])
+def test_complexity(name, setup, run, expected):
+    measured = exponent(setup, run)
+    assert measured <= expected + tolerance, "{0} scales with n ** {1:.2f}".format(
+        name, measured
+    )
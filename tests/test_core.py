@@ -0,0 +1,106 @@
+import importlib.util
+import os
+
+import pytest
+from hypothesis import given, strategies as st
+
+import jama.change as cmod
+from jama import core
+
+edits = st.lists(
+    st.tuples(st.booleans(), st.integers(0, 1000), st.integers(0, 5)), max_size=30
+)
+
+# Differential tests: jama and jama2 replay the same user level edits and have to
+# project the same files
+
+
+def load_jama2():
+    path = os.path.join(os.path.dirname(__file__), "..", "jama2", "change.py")
+    spec = importlib.util.spec_from_file_location("jama2_change", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+jama2 = load_jama2()
+
+
+def edit(file_, labels, index, insert, pos, size):
+    # The libraries allocate different uids, so lines are labeled with the edit that
+    # inserted them
+    pos = pos % (len(file_) + 1)
+    if not insert:
+        return file_.delete(pos, size)
+    file_ = file_.insert(pos, size)
+    for offset, uid in enumerate(file_.node_list[pos : pos + size]):
+        labels[uid] = (index, offset)
+    return file_
+
+
+@given(st.integers(0, 20), edits)
+def test_gen_differential(initial, ops):
+    cur = cmod.FileReprEdit.from_size(initial)
+    cur2 = jama2.FileReprEdit.from_size(initial)
+    labels = {uid: (-1, x) for x, uid in enumerate(cur.node_list)}
+    labels2 = {uid: (-1, x) for x, uid in enumerate(cur2.node_list)}
+    state = cmod.State.from_file(cur)
+    state2 = jama2.State.from_file(cur2)
+    for index, op in enumerate(ops):
+        prev, cur = cur, edit(cur, labels, index, *op)
+        prev2, cur2 = cur2, edit(cur2, labels2, index, *op)
+        for x in cmod.Change.from_diff(prev, cur):
+            state = x.apply(state)
+        for x in jama2.Change.from_diff(prev2, cur2):
+            state2 = x.apply(state2)
+        file_ = state.to_file()
+        file2 = state2.to_file()
+        assert [labels[x] for x in file_.node_list] == [
+            labels2[x] for x in file2.node_list
+        ]
+        assert file_.node_list == cur.node_list
+        assert file2.node_list == cur2.node_list
+
+
+def test_conflict():
+    state = jama2.State.from_file(jama2.FileReprEdit.from_size(2))
+    state = jama2.Insert(0, [2], 1).apply(state)
+    state = jama2.State(
+        state.nodes.append(True), state.edges.add((0, 3)).add((3, 1)), 3, state.history
+    )
+    with pytest.raises(jama2.ConflictError):
+        state.to_file()
+    assert jama2.encode_node(jama2.Nodes.start) == core.START
+    assert jama2.encode_node(jama2.Nodes.end) == core.END
+    assert jama2.encode_node(0) == core.CONTENT
+
+
+def test_core_edges():
+    state = jama2.State.from_file(jama2.FileReprEdit.from_size(3))
+    state = jama2.Delete(1).apply(state)
+    state = jama2.Insert(0, [3], 2).apply(state)
+    state = jama2.Insert(jama2.Nodes.start, [4], 0).apply(state)
+    assert (jama2.Nodes.start, 4) in state.edges
+    assert state.core_edges == jama2.encode_edges(state.edges)
+    graph = jama2.State.from_graph(state.nodes, state.edges)
+    assert graph.core_edges == state.core_edges
+    assert graph.to_file() == state.to_file()
+    assert list(state.to_file().node_list) == [4, 0, 3, 2]
+    with pytest.raises(jama2.InconsistentError):
+        jama2.State.from_graph([True], {(jama2.Nodes.start, 0)}).to_file()
+
+
+def test_inconsistent():
+    nodes = [True] * 4
+    with pytest.raises(core.InconsistentError):
+        core.order(nodes, [(0, 2), (2, 3), (3, 2), (2, 1)])
+    with pytest.raises(core.InconsistentError):
+        core.order(nodes, [(0, 2)])
+    assert cmod.InconsistentError is core.InconsistentError
+    assert jama2.InconsistentError is core.InconsistentError
+    seq, lo, up, hidden = core.order(
+        [True, True, True, False], [(0, 3), (3, 2), (2, 1)]
+    )
+    assert seq == [0, 2, 1]
+    assert hidden == [(0, 3)]
+    assert not core.gaps(seq, lo)
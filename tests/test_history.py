@@ -0,0 +1,180 @@
+import random
+
+import pytest
+from pyrsistent import pvector
+
+import jama.change as cmod
+from jama.history import ColumnarHistory, CountingHistory
+from jama.memory import deep_sizeof
+
+cn = cmod.FileNodes.content
+
+
+def changes():
+    return [
+        cmod.Insert(cn + 0, [cn + 3, cn + 4], cn + 1),
+        cmod.Delete(cn + 1),
+        cmod.Revert([cmod.Delete(cn + 1)]),
+        cmod.Move(cmod._IntFileNodes.start, [cn + 2], cn + 0),
+        cmod.Delete(cn + 3),
+    ]
+
+
+def test_columnar():
+    history = ColumnarHistory(changes())
+    assert len(history) == 5
+    assert history == changes()
+    assert list(history) == changes()
+    assert history[-1] == cmod.Delete(cn + 3)
+    assert history[1:3] == changes()[1:3]
+    assert list(history.kinds()) == [0, 1, 2, 3, 1]
+    assert list(history.lines()) == [cn + 3, cn + 4, cn + 2]
+    with pytest.raises(IndexError):
+        history[5]
+    with pytest.raises(TypeError):
+        history.append(object())
+
+
+def test_shared_append():
+    base = ColumnarHistory(changes()[:2])
+    a = base.append(changes()[2])
+    b = base.append(changes()[3])
+    c = a.append(changes()[4])
+    assert base == changes()[:2]
+    assert a == changes()[:3]
+    assert b == changes()[:2] + [changes()[3]]
+    assert c == changes()[:3] + [changes()[4]]
+
+
+def test_state():
+    file_ = cmod.FileRepr.from_user([0, 1, 2])
+    plain = cmod.State.from_file(file_)
+    columnar = cmod.State.from_file(file_, history=ColumnarHistory())
+    for change in changes():
+        plain = change.apply(plain)
+        columnar = change.apply(columnar)
+    assert isinstance(columnar.history, ColumnarHistory)
+    assert columnar == plain
+    assert columnar.history_fingerprint == plain.history_fingerprint
+    assert columnar.linearize() == plain.linearize()
+    assert columnar.created_by(cn + 4) == changes()[0]
+    assert columnar.revert_indices([0]).to_file() == plain.revert_indices([0]).to_file()
+    graph = cmod.State.from_graph(plain.nodes, plain.edges, history=ColumnarHistory())
+    assert isinstance(graph.history, ColumnarHistory)
+
+
+def test_memory():
+    rnd = random.Random(0)
+    changes = []
+    uid = 1 << 20
+    for _ in range(2000):
+        if rnd.random() < 0.6:
+            size = rnd.randrange(1, 5)
+            lines = list(range(uid, uid + size))
+            changes.append(cmod.Insert(rnd.randrange(uid), lines, rnd.randrange(uid)))
+            uid += size
+        else:
+            changes.append(cmod.Delete(rnd.randrange(uid)))
+    plain = deep_sizeof(pvector(changes), set())
+    columnar = deep_sizeof(ColumnarHistory(changes), set())
+    assert columnar * 4 < plain
+
+
+def edited(rnd, size, edits):
+    cur = cmod.FileReprEdit.from_size(size)
+    changes = []
+    for _ in range(edits):
+        prev = cur
+        pos = rnd.randrange(len(cur) + 1)
+        if rnd.random() < 0.6:
+            cur = cur.insert(pos, rnd.randrange(1, 5))
+        else:
+            cur = cur.delete(pos, rnd.randrange(1, 5))
+        changes.extend(cmod.Change.from_diff(prev, cur))
+    return changes
+
+
+def test_counting():
+    history = CountingHistory().append(None).extend([1, 2])
+    assert len(history) == 3
+    assert history == CountingHistory(3)
+    assert history != CountingHistory(2)
+    assert list(CountingHistory()) == []
+    with pytest.raises(IndexError):
+        history[0]
+    with pytest.raises(IndexError):
+        list(history)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_lightweight(seed):
+    rnd = random.Random(seed)
+    file_ = cmod.FileReprEdit.from_size(rnd.randrange(30))
+    changes = edited(rnd, len(file_), 10)
+    plain = cmod.State.from_file(file_)
+    light = cmod.State.from_file(file_, history=CountingHistory())
+    for change in changes:
+        plain = change.apply(plain)
+        light = change.apply(light)
+    transaction = cmod.State.from_file(file_, history=CountingHistory()).transaction()
+    for change in changes:
+        transaction.apply(change)
+    in_place = transaction.finish()
+    # Without provenance all hidden nodes of the graph are tombstones
+    tombstones = cmod.State.from_graph(plain.nodes, plain.edges).tombstones
+    for state in (light, in_place):
+        assert len(state.history) == len(changes)
+        assert state.nodes == plain.nodes
+        assert state.edges == plain.edges
+        assert state.fingerprint == plain.fingerprint
+        assert state.history_fingerprint == plain.history_fingerprint
+        assert state.linearize() == plain.linearize()
+        assert not state.creators
+        assert not state.hiders
+        assert state.tombstones == tombstones
+    assert in_place == light
+    assert in_place.fingerprint == cmod.graph_fingerprint(plain.nodes, plain.edges)
+
+
+def test_transaction():
+    file_ = cmod.FileRepr.from_user([0, 1, 2])
+    with pytest.raises(ValueError):
+        cmod.State.from_file(file_).transaction()
+    state = cmod.State.from_file(file_, history=CountingHistory())
+    transaction = state.transaction()
+    transaction.apply(cmod.Insert(cn, [cn + 3], cn + 1))
+    transaction.apply(cmod.Delete(cn + 3))
+    with pytest.raises(TypeError):
+        transaction.apply(cmod.Revert([cmod.Delete(cn + 3)]))
+    with pytest.raises(AssertionError):
+        transaction.apply(cmod.Insert(cn + 1, [cn + 3], cn + 2))
+    changed = transaction.finish()
+    assert state.to_file().to_user() == [0, 1, 2]
+    assert changed.to_file().to_user() == [0, 1, 2]
+    assert (cn, cn + 3) in changed.edges
+    assert (cn, cn + 1) not in changed.edges
+    # No provenance to revert
+    with pytest.raises(ValueError):
+        changed.revert(cmod.Revert([cmod.Delete(cn + 3)]))
+
+
+def test_transaction_move():
+    a = cmod.FileRepr.from_user(range(6))
+    b = cmod.FileRepr.from_user([3, 4, 0, 1, 2, 5])
+    changes = list(cmod.Change.from_diff(a, b, moves=True))
+    # The moves have to see the edges of the insert, which are only in the transaction
+    changes.insert(0, cmod.Insert(cn + 4, [cn + 6], cn + 5))
+    changes.append(cmod.Delete(cn + 1))
+    assert any(isinstance(x, cmod.Move) for x in changes)
+    light = cmod.State.from_file(a, history=CountingHistory())
+    transaction = light.transaction()
+    for change in changes:
+        light = change.apply(light)
+        transaction.apply(change)
+    in_place = transaction.finish()
+    assert in_place == light
+    assert in_place.fingerprint == light.fingerprint
+    assert in_place.to_file() == light.to_file()
+    assert sorted(in_place.to_file().to_user()) == [0, 2, 3, 4, 5, 6]
+    with pytest.raises(cmod.InconsistentError):
+        in_place.transaction().apply(cmod.Move(cn, [cn + 5, cn + 3], cn + 2))
@@ -0,0 +1,89 @@
+import tracemalloc
+
+from pyrsistent import pvector
+
+import jama.change as cmod
+from jama.history import ColumnarHistory, CountingHistory
+from jama.memory import deep_sizeof, estimate_size, memory_report
+
+# Bytes per line a state may use, measured with tracemalloc. The pset of edges dominates
+# with about 200 bytes per line.
+budget_per_line = 400
+
+
+def build(size, history=None):
+    a = cmod.FileReprEdit.from_size(size)
+    b = a.delete(size // 4, size // 8).insert(size // 2, size // 8)
+    state = cmod.State.from_file(a, history=history)
+    for change in cmod.Change.from_diff(a, b):
+        state = change.apply(state)
+    return state
+
+
+def small_edits(size, history=None):
+    # One change per deleted or inserted line
+    file_ = cmod.FileReprEdit.from_size(size)
+    state = cmod.State.from_file(file_, history=history)
+    for line in range(0, size, 4):
+        edited = file_.delete(line, 1).insert(line + 1, 1)
+        for change in cmod.Change.from_diff(file_, edited):
+            state = change.apply(state)
+        file_ = edited
+    return state
+
+
+def test_memory_report():
+    state = cmod.State.from_file(cmod.FileReprEdit.from_size(3))
+    report = memory_report(state)
+    assert report.lines == 3
+    assert report.tombstones == 0
+    assert report.tombstone_ratio == 0.0
+    assert report.history > 0
+    assert 0 < report.caches < report.edges
+    assert report.total == (
+        report.nodes + report.edges + report.history + report.caches
+    )
+    state = cmod.Delete.from_user(1).apply(state)
+    report = memory_report(state)
+    assert report.lines == 2
+    assert report.tombstones == 1
+    assert report.tombstone_ratio == 1 / 3
+    assert report.bytes_per_line == report.total / 2
+
+
+def test_memory_report_holes():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 4]))
+    report = memory_report(state)
+    assert report.lines == 2
+    assert report.tombstones == 0
+
+
+def test_deep_sizeof_shared():
+    seen = set()
+    a = (1000, 2000)
+    size = deep_sizeof([a], seen)
+    assert size > 0
+    assert deep_sizeof([a], seen) < size
+    assert deep_sizeof(a, seen) == 0
+
+
+def test_memory_regression():
+    size = 4000
+    # Allocations on first use (caches, lazily built tables) are not per line
+    build(100)
+    tracemalloc.start()
+    try:
+        state = build(size)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    report = memory_report(state)
+    assert current / report.lines < budget_per_line
+    # The estimate has to be in the same ballpark as what was really allocated
+    assert 0.5 < report.total / current < 2.0
+
+
+def test_estimate_size():
+    for history in (pvector, ColumnarHistory, CountingHistory):
+        for state in (build(4000, history()), small_edits(800, history())):
+            assert 0.5 < estimate_size(state) / memory_report(state).total < 2.0
@@ -0,0 +1,50 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from hypothesis import given, strategies as st
+
+from jama import change as cmod, parallel
+
+
+def random_edit(file_, rnd):
+    pos = rnd.randrange(len(file_) + 1)
+    if rnd.random() < 0.6:
+        return file_.insert(pos, rnd.randrange(1, 4))
+    return file_.delete(pos, rnd.randrange(1, 3))
+
+
+def concurrent_state(seed, size=40, edits=6):
+    rnd = random.Random(seed)
+    base = cmod.FileReprEdit.from_size(size)
+    state = cmod.State.from_file(base)
+    for replica in (1, 2):
+        cur = cmod.ReplicaFileReprEdit(base.node_list, state.max_node, replica)
+        for _ in range(edits):
+            cur = random_edit(cur, rnd)
+        for change in cmod.Change.from_diff(base, cur):
+            state = change.apply(state)
+    return state
+
+
+def test_cut_vertices():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 1, 2]))
+    cn = cmod.FileNodes.content
+    assert parallel.cut_vertices(list(state.edges)) == [0, cn, cn + 1, cn + 2, 1]
+    state = cmod.Insert(cn, [cn + 3], cn + 2).apply(state)
+    assert parallel.cut_vertices(list(state.edges)) == [0, cn, cn + 2, 1]
+
+
+@given(st.integers(0, 1 << 32), st.integers(1, 6))
+def test_partition(seed, parts):
+    state = concurrent_state(seed)
+    segments = parallel.partition(state, parts)
+    assert 1 <= len(segments) <= parts
+    linears = [parallel.project(x) for x in segments]
+    assert parallel.stitch(segments, linears) == state.linearize()
+
+
+def test_linearize_files():
+    states = [concurrent_state(seed, size) for seed, size in enumerate([5, 80, 20])]
+    with ThreadPoolExecutor(2) as executor:
+        linears = parallel.linearize_files(executor, states, split=50, parts=4)
+    assert linears == [x.linearize() for x in states]
@@ -0,0 +1,50 @@
+from hypothesis import given, strategies as st
+
+import jama.change as cmod
+from jama.piece import PieceTable
+
+edits = st.lists(
+    st.tuples(st.booleans(), st.integers(0, 1000), st.integers(0, 5)), max_size=50
+)
+
+
+def replay(file_, ops):
+    session = file_.edit()
+    for insert, pos, size in ops:
+        if insert:
+            pos = pos % (len(file_) + 1)
+            file_ = file_.insert(pos, size)
+            session.insert(pos, size)
+        else:
+            pos = pos % (len(file_) + 1)
+            file_ = file_.delete(pos, size)
+            session.delete(pos, size)
+        assert len(session) == len(file_)
+    return file_, session.finish()
+
+
+@given(st.integers(0, 20), edits)
+def test_session(initial, ops):
+    file_, result = replay(cmod.FileReprEdit.from_size(initial), ops)
+    assert result == file_
+
+
+@given(st.integers(0, 20), st.integers(0, cmod.MAX_REPLICAS - 1), edits)
+def test_replica_session(initial, replica, ops):
+    base = cmod.FileReprEdit.from_size(initial)
+    file_ = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, replica)
+    file_, result = replay(file_, ops)
+    assert isinstance(result, cmod.ReplicaFileReprEdit)
+    assert result == file_
+
+
+def test_piece_table():
+    table = PieceTable.from_node_list(range(10, 20))
+    assert table.pieces == 1
+    changed = table.insert(5, 100, 16, 3).delete(0, 2)
+    assert list(changed) == [12, 13, 14, 100, 116, 132, 15, 16, 17, 18, 19]
+    assert changed.pieces == 3
+    assert list(table) == list(range(10, 20))
+    assert list(PieceTable.from_node_list(changed)) == list(changed)
+    assert PieceTable.from_node_list(changed).pieces == 3
+    assert list(changed.delete(2, 100)) == [12, 13]
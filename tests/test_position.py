@@ -0,0 +1,85 @@
+import pytest
+from hypothesis import given, strategies as st
+
+import jama.change as cmod
+from jama.position import PositionIndex
+
+cn = cmod.FileNodes.content
+
+edits = st.lists(
+    st.tuples(st.booleans(), st.integers(0, 1000), st.integers(0, 5)), max_size=50
+)
+
+
+def check(index, node_list):
+    assert list(index) == node_list
+    assert len(index) == len(node_list)
+    for offset, uid in enumerate(node_list):
+        assert index[offset] == uid
+        assert index.index(uid) == offset
+    for offset in range(len(node_list) + 1):
+        assert index.lines(offset, 3) == node_list[offset : offset + 3]
+
+
+@given(st.integers(0, 20), edits)
+def test_gen_edits(initial, ops):
+    state = cmod.State.from_file(cmod.FileReprEdit.from_size(initial))
+    versions = [(state, list(state.to_file().node_list))]
+    for insert, pos, size in ops:
+        pos = pos % (len(versions[-1][1]) + 1)
+        if insert:
+            state = state.insert_at(pos, size)
+        else:
+            state = state.delete_at(pos, size)
+        versions.append((state, list(state.to_file().node_list)))
+    # Older versions are not changed
+    for state, node_list in versions:
+        check(state.position_index(), node_list)
+        assert state.positions.keys.keys() == set(node_list)
+
+
+def test_relabel():
+    index = PositionIndex.from_node_list([cn, cn + 1])
+    node_list = [cn, cn + 1]
+    for uid in range(cn + 2, cn + 300):
+        index = index.insert(1, [uid])
+        node_list.insert(1, uid)
+    check(index, node_list)
+    keys = [index.keys[x] for x in node_list]
+    assert keys == sorted(set(keys))
+
+
+def test_position_index():
+    state = cmod.State.from_file(cmod.FileReprEdit.from_size(5))
+    index = state.position_index()
+    assert state.position_index() is index
+    assert index[-1] == cn + 4
+    with pytest.raises(IndexError):
+        index[5]
+    with pytest.raises(ValueError):
+        index.index(cn + 5)
+    assert cn + 5 not in index
+    state = state.insert_at(5, 2)
+    assert state.to_file().node_list == list(range(cn, cn + 7))
+    with pytest.raises(IndexError):
+        state.insert_at(8, 1)
+    assert state.delete_at(7, 1) is state
+    # Replica scoped uids don't collide with concurrent writers
+    base = cmod.FileReprEdit.from_size(3)
+    merged = cmod.State.from_file(base)
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 0).insert(0, 1)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1).insert(3, 1)
+    for change in cmod.Change.from_diff(base, a):
+        merged = change.apply(merged)
+    edited = merged.insert_at(2, 2, replica=0)
+    assert all(cmod.unpack_uid(x)[1] == 0 for x in edited.to_file().node_list[2:4])
+    for change in cmod.Change.from_diff(base, b):
+        edited = change.apply(edited)
+    assert len(edited.to_file().node_list) == 7
+    # Other changes reset the index
+    changed = cmod.Delete(cn).apply(state)
+    assert changed.positions is None
+    assert list(changed.position_index()) == list(range(cn + 1, cn + 7))
+    conflict = cmod.Insert(cn, [cn + 9], cn + 2).apply(changed)
+    with pytest.raises(cmod.ConflictError):
+        conflict.position_index()
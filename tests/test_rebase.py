@@ -0,0 +1,69 @@
+import random
+
+import pytest
+from hypothesis import given, strategies as st
+
+import jama.change as cmod
+from jama.rebase import transform_stack
+
+
+def random_edit(file_, rnd):
+    pos = rnd.randrange(len(file_) + 1)
+    if rnd.random() < 0.6:
+        return file_.insert(pos, rnd.randrange(1, 3))
+    return file_.delete(pos, rnd.randrange(1, 3))
+
+
+def stack(seed, size=8, upstream=2, commits=6):
+    rnd = random.Random(seed)
+    base = cmod.FileReprEdit.from_size(size)
+    state = cmod.State.from_file(base)
+    cur = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1)
+    for _ in range(upstream):
+        prev, cur = cur, random_edit(cur, rnd)
+        for change in cmod.Change.from_diff(prev, cur):
+            state = change.apply(state)
+    cur = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2)
+    batches = []
+    for _ in range(commits):
+        prev, cur = cur, random_edit(cur, rnd)
+        batches.append(list(cmod.Change.from_diff(prev, cur)))
+    return state, batches
+
+
+@given(st.integers(0, 1 << 32))
+def test_first_conflict(seed):
+    base, batches = stack(seed)
+    result = transform_stack(base, batches)
+    assert len(result) == len(batches)
+    state = base
+    expected = None
+    for index, batch in enumerate(batches):
+        for change in batch:
+            state = change.apply(state)
+        assert result[index] == state
+        if expected is None and state.linearize().conflicts:
+            expected = index
+    assert result.head == state
+    assert result.first_conflict() == expected
+
+
+def test_lazy():
+    base = cmod.State.from_file(cmod.FileRepr.from_user([0, 1]))
+    cn = cmod.FileNodes.content
+    batches = [
+        [cmod.Delete(cn)],
+        [cmod.Insert(cn + 1, [cn + 2], cmod._IntFileNodes.end)],
+        [cmod.Insert(cn + 1, [cn + 3], cmod._IntFileNodes.end)],
+        [cmod.Delete(cn + 3)],
+    ]
+    result = transform_stack(base, batches)
+    assert result._candidates == [False, False, True, False]
+    assert result.first_conflict() == 2
+    assert list(result._linears) == [2]
+    assert result.to_file(-1).to_user() == [1, 2]
+    # to_file uses and fills the cache
+    assert list(result._linears) == [2, 3]
+    assert result.linearize(-1) is result.linearize(3)
+    with pytest.raises(cmod.ConflictError):
+        result.to_file(2)
@@ -0,0 +1,102 @@
+import io
+
+import pytest
+
+import jama.change as cmod
+from jama.render import render
+
+cn = cmod.FileNodes.content
+
+
+def conflicted():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    c = cmod.Delete.from_user(1).apply(b)
+    d = cmod.Insert.from_user(0, [3], 2).apply(c)
+    return cmod.Insert.from_user(0, [4, 5], 2).apply(d)
+
+
+content = {uid + cn: "line {0}\n".format(uid).encode() for uid in range(6)}
+
+
+def test_render_clean():
+    a = cmod.FileRepr.from_user([0, 1, 2])
+    b = cmod.State.from_file(a)
+    out = io.BytesIO()
+    assert render(b, content, out) == 0
+    assert out.getvalue() == b"line 0\nline 1\nline 2\n"
+
+
+def test_render_conflict():
+    out = io.BytesIO()
+    assert render(conflicted(), content, out, labels=("ours", "theirs")) == 1
+    assert out.getvalue() == (
+        b"line 0\n"
+        b"<<<<<<< ours\n"
+        b"line 4\n"
+        b"line 5\n"
+        b"=======\n"
+        b"line 3\n"
+        b">>>>>>> theirs\n"
+        b"line 2\n"
+    )
+
+
+def test_render_diff3():
+    out = io.BytesIO()
+    render(conflicted().linearize(), content.get, out, diff3=True)
+    assert out.getvalue() == (
+        b"line 0\n"
+        b"<<<<<<<\n"
+        b"line 4\n"
+        b"line 5\n"
+        b"|||||||\n"
+        b"line 1\n"
+        b"=======\n"
+        b"line 3\n"
+        b">>>>>>>\n"
+        b"line 2\n"
+    )
+
+
+def test_render_merge_base():
+    # Line 1 is deleted before the sides diverge, so it is not in their merge base
+    state = conflicted()
+    out = io.BytesIO()
+    render(state, content, out, diff3=True, since=1)
+    assert b"|||||||\n=======\n" in out.getvalue()
+    out = io.BytesIO()
+    render(state, content, out, diff3=True, since=0)
+    assert b"|||||||\nline 1\n=======\n" in out.getvalue()
+    with pytest.raises(ValueError):
+        render(state.linearize(), content, out, since=0)
+
+
+def test_render_unterminated():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0]))
+    state = cmod.Insert.from_user(cmod.FileNodes.start, [1], cmod.FileNodes.end).apply(
+        state
+    )
+    out = io.BytesIO()
+    render(state, {cn: b"a", cn + 1: b"b"}, out, chunk_size=1)
+    assert out.getvalue() == b"<<<<<<<\nb\n=======\na\n>>>>>>>\n"
+
+
+class Sink(object):
+    def __init__(self):
+        self.size = 0
+        self.largest = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.largest = max(self.largest, len(data))
+
+
+def test_render_chunks():
+    size = 20000
+    state = cmod.State.from_file(cmod.FileReprEdit.from_size(size))
+    line = b"x" * 99 + b"\n"
+    sink = Sink()
+    render(state, lambda uid: line, sink, chunk_size=4096)
+    assert sink.size == size * len(line)
+    assert sink.largest < 4096 + len(line)
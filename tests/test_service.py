@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from jama import change as cmod
+from jama.service import MergeService, merge
+
+
+def sides():
+    base = cmod.FileReprEdit.from_size(5)
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2)
+    return base, a.insert(1, 2).delete(3, 1), b.insert(5, 1)
+
+
+calls = []
+
+
+def slow(x):
+    calls.append(threading.get_ident())
+    time.sleep(0.1)
+    return x * 2
+
+
+def test_merge():
+    base, a, b = sides()
+    linear = merge(base, a, b)
+    assert not linear.conflicts
+    deleted = set(base.node_list) - set(a.node_list)
+    visible = (set(a.node_list) | set(b.node_list)) - deleted
+    assert sorted(linear.file_.node_list) == sorted(visible)
+
+    async def main(executor):
+        service = MergeService(executor)
+        assert await service.merge(base, a, b) == linear
+        assert await service.diff(base, a) == list(cmod.Change.from_diff(base, a))
+        state = cmod.State.from_file(base)
+        assert await service.to_file(state) == state.to_file()
+        assert service.pending == 0
+
+    with ThreadPoolExecutor(2) as executor:
+        asyncio.run(main(executor))
+    with ProcessPoolExecutor(1) as executor:
+        asyncio.run(main(executor))
+
+
+def test_coalesce():
+    async def main(executor):
+        service = MergeService(executor)
+        results = await asyncio.gather(*[service.run(slow, 3) for _ in range(5)])
+        assert results == [6] * 5
+        assert service.pending == 0
+
+    calls.clear()
+    with ThreadPoolExecutor(4) as executor:
+        asyncio.run(main(executor))
+    assert len(calls) == 1
+
+
+def test_deadline():
+    async def main(executor):
+        service = MergeService(executor, concurrency=1)
+        with pytest.raises(asyncio.TimeoutError):
+            await service.run(slow, 1, timeout=0.01)
+        # Queued behind the semaphore, cancelled before it runs
+        first = asyncio.ensure_future(service.run(slow, 2))
+        second = asyncio.ensure_future(service.run(slow, 3))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        assert await first == 4
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        assert service.pending == 0
+
+    calls.clear()
+    with ThreadPoolExecutor(1) as executor:
+        asyncio.run(main(executor))
+    assert len(calls) == 2
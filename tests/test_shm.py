@@ -0,0 +1,92 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from jama import change as cmod
+from jama.codec import DecodeError
+from jama.history import CountingHistory
+from jama.shm import SharedState, export_file, export_shared
+
+cn = cmod.FileNodes.content
+
+
+def conflicted():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 1, 2]))
+    for change in [
+        cmod.Insert(cn + 0, [cn + 3], cn + 1),
+        cmod.Insert(cn + 0, [cn + 4, cn + 5], cn + 1),
+        cmod.Delete(cn + 2),
+        cmod.Revert([cmod.Delete(cn + 2)]),
+        cmod.Delete(cn + 1),
+    ]:
+        state = change.apply(state)
+    return state
+
+
+def check(view, state):
+    assert view.linearize() == state.linearize()
+    assert view.max_node == state.max_node
+    assert view.fingerprint == state.fingerprint
+    copy = view.to_state()
+    assert copy == state
+    assert copy.history_fingerprint == view.history_fingerprint
+
+
+def attached_linearize(name):
+    with SharedState.attach(name) as view:
+        return view.linearize()
+
+
+def test_shared():
+    state = conflicted()
+    shm = export_shared(state)
+    try:
+        with SharedState.attach(shm.name) as view:
+            check(view, state)
+            with pytest.raises(cmod.ConflictError):
+                view.to_file()
+            with pytest.raises(TypeError):
+                view.nodes[0] = 0
+        with ProcessPoolExecutor(1) as executor:
+            linear = executor.submit(attached_linearize, shm.name).result()
+        assert linear == state.linearize()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_file(tmp_path):
+    path = str(tmp_path / "state")
+    state = cmod.State.from_file(cmod.FileRepr.from_user(range(5)))
+    export_file(state, path)
+    with SharedState.open(path) as view:
+        check(view, state)
+        assert view.to_file() == state.to_file()
+    with open(path, "r+b") as f:
+        f.truncate(20)
+    with pytest.raises(DecodeError):
+        SharedState.open(path)
+
+
+def test_counting_history(tmp_path):
+    path = str(tmp_path / "state")
+    file_ = cmod.FileRepr.from_user(range(5))
+    state = cmod.State.from_file(file_, history=CountingHistory())
+    state = cmod.Insert(cn + 1, [cn + 5], cn + 2).apply(state)
+    state = cmod.Delete(cn + 3).apply(state)
+    export_file(state, path)
+    with SharedState.open(path) as view:
+        check(view, state)
+        assert view.changes == 2
+        assert list(view.history()) == []
+        copy = view.to_state()
+        assert copy.history == CountingHistory(2)
+        assert copy.tombstones == state.tombstones
+        assert not copy.creators
+    shm = export_shared(state)
+    try:
+        with SharedState.attach(shm.name) as view:
+            check(view, state)
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from jama import change as cmod
+from jama.codec import DecodeError
+from jama.history import CountingHistory
+from jama.memory import estimate_size
+from jama.store import Store, index_name
+
+cn = cmod.FileNodes.content
+
+
+def edited(size, inserts):
+    state = cmod.State.from_file(cmod.FileRepr.from_user(range(size)))
+    for i in range(inserts):
+        state = cmod.Insert(cn + i, [state.max_node + 1], cn + i + 1).apply(state)
+    return state
+
+
+def oid(x):
+    return bytes([x]) * 20
+
+
+def test_store(tmp_path):
+    directory = str(tmp_path / "store")
+    states = {"a.txt": edited(3, 1), "b/c.py": edited(10, 4), "d": edited(0, 0)}
+    with Store(directory) as store:
+        assert len(store) == 0
+        assert store.get("a.txt") is None
+        store.write((p, oid(i), s) for i, (p, s) in enumerate(states.items()))
+        assert len(store) == 3
+    with Store(directory) as store:
+        assert len(store) == 3
+        assert "b/c.py" in store
+        assert "e" not in store
+        assert store.oid("d") == oid(2)
+        for path, state in states.items():
+            loaded = store.get(path)
+            assert loaded == state
+            assert loaded.to_file() == state.to_file()
+        assert store.get("a.txt", oid(0)) == states["a.txt"]
+        assert store.hits == 1
+        assert store.get("a.txt", oid(1)) is None
+        # Replace one, keep the others
+        new = edited(5, 2)
+        store.write([("a.txt", oid(9), new)])
+        assert len(store) == 3
+        assert store.get("a.txt") == new
+        assert store.get("a.txt", oid(0)) is None
+        assert store.get("b/c.py") == states["b/c.py"]
+        # Throwaway States only count their changes
+        file_ = cmod.FileRepr.from_user(range(3))
+        light = cmod.State.from_file(file_, history=CountingHistory())
+        light = cmod.Delete(cn + 1).apply(light)
+        store.write([("light", oid(7), light)])
+        loaded = store.get("light")
+        assert loaded == light
+        assert loaded.history_fingerprint == light.history_fingerprint
+
+
+def test_lru(tmp_path):
+    states = [edited(20 + i, 2) for i in range(4)]
+    with Store(str(tmp_path)) as store:
+        store.write((str(i), oid(i), s) for i, s in enumerate(states))
+        sizes = [estimate_size(store.get(str(i))) for i in range(4)]
+    # Room for two States
+    with Store(str(tmp_path), budget=max(sizes) * 5 // 2) as store:
+        store.prefetch(["0", "1", "missing"])
+        assert store.misses == 2
+        assert store.get("0") == states[0]
+        assert store.hits == 1
+        store.get("2")
+        store.get("3")
+        # Least recently used first
+        assert store.misses == 4
+        store.get("0")
+        assert store.misses == 5
+        store.get("3")
+        assert store.hits == 2
+        store.prefetch(["3"])
+        assert store.misses == 5
+
+
+def test_corrupt_index(tmp_path):
+    with open(os.path.join(str(tmp_path), index_name), "wb") as f:
+        f.write(b"x" * 64)
+    with pytest.raises(DecodeError):
+        Store(str(tmp_path))
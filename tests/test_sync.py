@@ -0,0 +1,216 @@
+import io
+import socket
+import threading
+
+import pytest
+
+import jama.change as cmod
+from jama import codec, sync
+
+
+class Counting(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.sent = 0
+        self.received = 0
+
+    def write(self, data):
+        self.sent += len(data)
+        return self.stream.write(data)
+
+    def read(self, size):
+        data = self.stream.read(size)
+        self.received += len(data)
+        return data
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run_sync(a, b):
+    left, right = socket.socketpair()
+    with left, right:
+        left_stream = Counting(left.makefile("rwb"))
+        right_stream = Counting(right.makefile("rwb"))
+        result = {}
+
+        def responder():
+            result["b"] = sync.sync(b, right_stream, initiator=False)
+
+        thread = threading.Thread(target=responder)
+        thread.start()
+        result["a"] = sync.sync(a, left_stream, initiator=True)
+        thread.join()
+    return result["a"], result["b"], left_stream.sent + right_stream.sent
+
+
+def common_state(size, changes):
+    state = cmod.State.from_file(cmod.FileReprEdit.from_size(size))
+    for line in range(changes):
+        state = cmod.Delete.from_user(line * 2).apply(state)
+        uids = [size + line * 4 + x for x in range(4)]
+        state = cmod.Insert.from_user(line * 2, uids, line * 2 + 1).apply(state)
+    return state
+
+
+def test_codec():
+    changes = [
+        cmod.Insert.from_user(cmod.FileNodes.start, [3, 4], 2),
+        cmod.Delete.from_user(1),
+        cmod.Insert(0, [2**40], 1),
+        cmod.Move(3, [5, 6], 1),
+    ]
+    data = codec.encode_changes(changes)
+    assert list(codec.decode_changes(data)) == changes
+    with pytest.raises(codec.DecodeError):
+        list(codec.decode_changes(data[:-1]))
+    with pytest.raises(codec.DecodeError):
+        list(codec.decode_changes(b"\x09"))
+    out = bytearray()
+    for value in (0, 1, -1, 63, -64, 64, 2**64):
+        codec.write_varint(out, value)
+    pos = 0
+    for value in (0, 1, -1, 63, -64, 64, 2**64):
+        decoded, pos = codec.read_varint(out, pos)
+        assert decoded == value
+    invalid = codec.encode_changes([cmod.Insert.unchecked(2, [3], 2)])
+    with pytest.raises(codec.DecodeError):
+        list(codec.decode_changes(invalid))
+    assert list(codec.decode_changes(invalid, check=False))[0].successor == 2
+
+
+def test_receive_invalid():
+    state = cmod.State.from_file(cmod.FileRepr.from_user([0, 1]))
+    for changes in [
+        [cmod.Delete(100)],
+        [cmod.Insert(2, [2], 3)],
+        [cmod.Insert(2, [5], 3), cmod.Insert(5, [6], 2)],
+    ]:
+        stream = io.BytesIO()
+        codec.write_message(stream, codec.encode_changes(changes))
+        stream.seek(0)
+        with pytest.raises(cmod.InconsistentError):
+            sync._receive_changes(stream, state, sync.ChangeSet(state.history), True)
+
+
+def test_sync_move():
+    base = cmod.State.from_file(cmod.FileRepr.from_user([0, 1, 2, 3]))
+    cn = cmod.FileNodes.content
+    moved = cmod.Move(cmod._IntFileNodes.start, [cn + 2], cn).apply(base)
+    assert moved.to_file().to_user() == [2, 0, 1, 3]
+    with pytest.raises(ValueError):
+        sync.sync(moved, io.BytesIO(), initiator=True)
+    for check, error in ((True, cmod.InconsistentError), (False, ValueError)):
+        stream = io.BytesIO()
+        codec.write_message(stream, codec.encode_changes(moved.history))
+        stream.seek(0)
+        with pytest.raises(error):
+            sync._receive_changes(stream, base, sync.ChangeSet(base.history), check)
+
+
+def test_sync_equal():
+    state = common_state(20, 5)
+    a, b, sent = run_sync(state, state)
+    assert a == state
+    assert b == state
+    assert sent < 64
+
+
+def test_sync_both_ways():
+    base = common_state(20, 5)
+    a = cmod.Insert.from_user(3, [100, 101], 4).apply(base)
+    b = cmod.Delete.from_user(11).apply(base)
+    b = cmod.Delete.from_user(13).apply(b)
+    c, d, _ = run_sync(a, b)
+    assert c.fingerprint == d.fingerprint
+    assert len(c.history) == len(d.history) == 13
+    assert not c.nodes[11 + cmod.FileNodes.content]
+    assert d.nodes[100 + cmod.FileNodes.content]
+
+
+def test_sync_empty():
+    base = cmod.State.from_file(cmod.FileReprEdit.from_size(3))
+    a = cmod.Delete.from_user(1).apply(base)
+    c, d, _ = run_sync(base, a)
+    assert c.fingerprint == d.fingerprint == a.fingerprint
+    c, d, _ = run_sync(a, base)
+    assert c.fingerprint == d.fingerprint == a.fingerprint
+
+
+def test_sync_proportional():
+    base = common_state(4000, 1000)
+    a = cmod.Delete.from_user(1).apply(base)
+    b = cmod.Delete.from_user(3).apply(base)
+    b = cmod.Delete.from_user(5).apply(b)
+    c, d, sent = run_sync(a, b)
+    assert c.fingerprint == d.fingerprint
+    assert len(c.history) == 2003
+    full = len(codec.encode_changes(base.history))
+    assert sent < full / 5
+
+
+def test_sync_replicas():
+    base = cmod.FileReprEdit.from_size(10)
+    state = cmod.State.from_file(base)
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1).insert(2, 3)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2).insert(7, 2)
+    state_a = state
+    for change in cmod.Change.from_diff(base, a):
+        state_a = change.apply(state_a)
+    state_b = state
+    for change in cmod.Change.from_diff(base, b):
+        state_b = change.apply(state_b)
+    c, d, _ = run_sync(state_a, state_b)
+    assert c.fingerprint == d.fingerprint
+    assert c.max_node == d.max_node
+
+
+def test_sync_move_insert():
+    # A moves lines 3 and 4 to the front, B inserts after line 4. By default the move
+    # is not a Move but a delete and an insert of new lines, so the order of the
+    # changes does not matter.
+    base = cmod.FileReprEdit.from_size(6)
+    state = cmod.State.from_file(base)
+    moved = cmod.FileRepr.from_user([3, 4, 0, 1, 2, 5])
+    with pytest.raises(ValueError):
+        list(cmod.Change.from_diff(base, moved))
+    a = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 1)
+    a = a.delete(3, 2).insert(0, 2)
+    b = cmod.ReplicaFileReprEdit(base.node_list, base.max_uid, 2).insert(5, 1)
+    changes_a = list(cmod.Change.from_diff(base, a))
+    changes_b = list(cmod.Change.from_diff(base, b))
+    assert not any(isinstance(x, cmod.Move) for x in changes_a)
+    ab = state.replay(changes_a + changes_b)
+    ba = state.replay(changes_b + changes_a)
+    assert ab.fingerprint == ba.fingerprint
+    assert ab.linearize() == ba.linearize()
+    c, d, _ = run_sync(state.replay(changes_a), state.replay(changes_b))
+    assert c.fingerprint == d.fingerprint == ab.fingerprint
+
+
+def test_sync_revert():
+    base = common_state(20, 5)
+    a = base.revert_indices([2, 3])
+    c, d, _ = run_sync(a, base)
+    assert c.fingerprint == d.fingerprint == a.fingerprint
+    assert d.reverted == a.reverted
+
+
+def test_sync_repeated_change():
+    # Equal changes in one history are different occurrences
+    base = common_state(20, 5)
+    delete = cmod.Delete.from_user(5)
+    a = delete.apply(base)
+    a = cmod.Revert([delete]).apply(a)
+    a = delete.apply(a)
+    line = 5 + cmod.FileNodes.content
+    assert not a.nodes[line]
+    for c, d, _ in (run_sync(a, base), run_sync(base, a)):
+        assert len(c.history) == len(d.history) == len(a.history)
+        assert c.fingerprint == d.fingerprint == a.fingerprint
+        assert not c.nodes[line] and not d.nodes[line]
+    # Both sides have the first Delete, only the rest is sent
+    b = delete.apply(base)
+    c, d, _ = run_sync(a, b)
+    assert c.fingerprint == d.fingerprint == a.fingerprint
+    assert len(d.history) == len(a.history)